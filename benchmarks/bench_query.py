@@ -0,0 +1,58 @@
+"""Per-query latency: new Totp on every query (before) vs long-lived Vault (after)
+
+Usage:
+    python benchmarks/bench_query.py [entries] [queries]
+"""
+import os
+import sys
+import json
+import tempfile
+import time
+from pathlib import Path
+
+plugindir = Path(__file__).absolute().parent.parent
+sys.path = [str(plugindir / p) for p in (".", "lib", "plugin")] + sys.path
+
+from plugin.lib import Crypt, Totp, Vault  # noqa: E402
+
+
+def make_storage(count: int):
+    entries = []
+    for i in range(count):
+        entries.append({
+            "name": f"Issuer{i}:user{i}@example.com",
+            "key": Crypt.encrypt_key("JBSWY3DPEHPK3PXP"),
+            "is_encrypted": True
+        })
+    with open("OTPList.json", "w") as f:
+        json.dump({"version": 1, "entries": entries}, f, indent=4)
+
+
+def measure(fn, queries: int) -> float:
+    start = time.perf_counter()
+    for _ in range(queries):
+        fn()
+    return (time.perf_counter() - start) / queries * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    settings = {"otpauthLinks": ""}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        make_storage(count)
+        vault = Vault()
+
+        before = measure(lambda: Totp(settings=settings), queries)
+        after = measure(lambda: vault.get(settings=settings), queries)
+        os.chdir(plugindir)
+
+    print(f"entries: {count}, queries: {queries}")
+    print(f"before (Totp per query): {before:.3f} ms/query")
+    print(f"after  (Vault):          {after:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
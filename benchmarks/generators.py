@@ -0,0 +1,95 @@
+"""Synthetic vaults and migration payloads for benchmarks"""
+import base64
+import random
+from urllib.parse import quote, urlencode
+
+from plugin.lib import Crypt
+from plugin.lib.models import Entrie, OtpConfig
+from plugin.migration_decoder.protobuf.otpauth_migration_pb2 import Payload
+
+ISSUERS = ("GitHub", "Google", "Discord", "AWS", "Azure", "GitLab", "Dropbox", "Slack", "Microsoft", "Cloudflare")
+ALGORITHMS = (("SHA1", 1), ("SHA256", 2), ("SHA512", 3))
+DIGITS = ((6, 1), (8, 2))
+PERIODS = (30, 60)
+
+
+def random_secret(rng: random.Random) -> bytes:
+    return bytes(rng.getrandbits(8) for _ in range(20))
+
+
+def b32(secret: bytes) -> str:
+    return base64.b32encode(secret).decode("utf-8").rstrip("=")
+
+
+def account(rng: random.Random, i: int) -> dict:
+    algorithm, _ = rng.choice(ALGORITHMS)
+    digits, _ = rng.choice(DIGITS)
+    return {
+        "issuer": rng.choice(ISSUERS),
+        "name": f"user{i}@example.com",
+        "secret": b32(random_secret(rng)),
+        "algorithm": algorithm,
+        "digits": digits,
+        "period": rng.choice(PERIODS),
+    }
+
+
+def otpauth_links(count: int, seed: int = 0) -> list:
+    """otpauth:// links with mixed algorithms, digits and periods"""
+    rng = random.Random(seed)
+    links = []
+    for i in range(count):
+        acc = account(rng, i)
+        params = urlencode({
+            "secret": acc["secret"],
+            "issuer": acc["issuer"],
+            "algorithm": acc["algorithm"],
+            "digits": acc["digits"],
+            "period": acc["period"],
+        })
+        links.append(f"otpauth://totp/{quote(acc['issuer'])}:{quote(acc['name'])}?{params}")
+    return links
+
+
+def migration_links(count: int, per_payload: int = 10, seed: int = 0) -> list:
+    """otpauth-migration:// links of one multi QR export, per_payload accounts each"""
+    rng = random.Random(seed)
+    batch_size = -(-count // per_payload)
+    links = []
+    for index in range(batch_size):
+        payload = Payload(version=1, batch_size=batch_size, batch_index=index, batch_id=seed + 1)
+        for i in range(index * per_payload, min(count, (index + 1) * per_payload)):
+            _, algorithm = rng.choice(ALGORITHMS)
+            _, digits = rng.choice(DIGITS)
+            payload.otp_parameters.add(
+                secret=random_secret(rng),
+                name=f"user{i}@example.com",
+                issuer=rng.choice(ISSUERS),
+                algorithm=algorithm,
+                digits=digits,
+                type=Payload.OTP_TYPE_TOTP,
+            )
+        data = base64.b64encode(payload.SerializeToString()).decode("utf-8")
+        links.append(f"otpauth-migration://offline?data={quote(data)}")
+    return links
+
+
+def vault(count: int, seed: int = 0) -> OtpConfig:
+    """Encrypted vault with mixed algorithms, digits and periods"""
+    rng = random.Random(seed)
+    accounts = [account(rng, i) for i in range(count)]
+    keys = Crypt.encrypt_many([acc["secret"] for acc in accounts])
+    return OtpConfig(
+        version=1,
+        entries=[
+            Entrie(
+                name=f"{acc['issuer']}:{acc['name']}",
+                key=Crypt.blob(key),
+                is_encrypted=True,
+                algorithm=acc["algorithm"],
+                digits=acc["digits"],
+                period=acc["period"],
+            )
+            for acc, key in zip(accounts, keys)
+        ],
+    )
@@ -0,0 +1,111 @@
+"""Import time report of the plugin and of the main.py client path, parsed from `python -X importtime`
+
+Usage:
+    python benchmarks/importtime.py [--runs N] [--top N] [--json report.json]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+plugindir = Path(__file__).absolute().parent.parent
+
+PATHS = ", ".join(repr(str(plugindir / p)) for p in (".", "lib", "plugin"))
+
+IMPORT_PLUGIN = f"import sys; sys.path = [{PATHS}] + sys.path; import plugin"
+
+IMPORT_MAIN = f"import sys; from pathlib import Path; sys.path = [{PATHS}] + sys.path; import resident"
+"""Imports of main.py before the request is forwarded or handled, they run on every keystroke
+"""
+
+LAZY_MODULES = ("pyotp", "google.protobuf", "pyperclip", "migration_decoder")
+"""Modules which must not be imported before the first query
+"""
+
+SERVER_MODULES = ("multiprocessing", "subprocess", "tempfile", "threading")
+"""Modules of the resident server, main.py must not import them while resident mode is off
+"""
+
+
+def eager(names: set, lazy_modules: tuple) -> list:
+    return sorted(
+        name for name in names
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in lazy_modules)
+    )
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Parse `-X importtime` output
+
+    Returns:
+        dict: {module: {"self_us": int, "cumulative_us": int}}
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = {
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        }
+    return modules
+
+
+def run_once(code: str) -> dict:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=plugindir, capture_output=True, text=True, check=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    return parse_importtime(process.stderr)
+
+
+def build_report(runs: int, top: int) -> dict:
+    samples = [run_once(IMPORT_PLUGIN) for _ in range(runs)]
+    main_samples = [run_once(IMPORT_MAIN) for _ in range(runs)]
+    names = set().union(*samples)
+    medians = {
+        name: statistics.median(
+            sample[name]["cumulative_us"] for sample in samples if name in sample)
+        for name in names
+    }
+    heaviest = sorted(medians.items(), key=lambda item: -item[1])[:top]
+    return {
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "total_us": medians.get("plugin", 0),
+        "main_us": statistics.median(sample.get("resident", {}).get("cumulative_us", 0) for sample in main_samples),
+        "top": [{"module": name, "cumulative_us": us} for name, us in heaviest],
+        "eager_lazy_modules": eager(names, LAZY_MODULES),
+        "main_server_modules": eager(set().union(*main_samples), SERVER_MODULES),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="Write the report into this file")
+    args = parser.parse_args()
+
+    report = build_report(runs=args.runs, top=args.top)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+
+    print(f"import plugin: {report['total_us'] / 1000:.1f} ms (median of {args.runs})")
+    print(f"main.py client (import resident): {report['main_us'] / 1000:.1f} ms")
+    for item in report["top"]:
+        print(f"{item['cumulative_us'] / 1000:8.1f} ms  {item['module']}")
+    if report["eager_lazy_modules"]:
+        print("imported eagerly: " + ", ".join(report["eager_lazy_modules"]))
+    if report["main_server_modules"]:
+        print("imported by main.py client: " + ", ".join(report["main_server_modules"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Memory benchmark: peak and retained memory of vault loading, per storage format
+
+Usage:
+    python benchmarks/memory.py [--sizes 1000,10000,50000] [--json results.json]
+
+Peak is the highest traced allocation while Totp loads the vault (or the search index is built),
+retained is what the loaded vault (or the index) keeps. Both are also given per entry, they
+should stay flat as the vault grows.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+plugindir = Path(__file__).absolute().parent.parent
+sys.path = [str(plugindir / p) for p in (".", "lib", "plugin")] + sys.path
+
+import generators  # noqa: E402
+from plugin.lib import Crypt, Files, SearchIndex, Totp  # noqa: E402
+from plugin.lib.crypt import PortableBackend  # noqa: E402
+
+
+def traced(fn) -> tuple:
+    """Run fn with tracemalloc on
+
+    Returns:
+        tuple: (fn result, peak bytes, retained bytes)
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, retained
+
+
+def memory_result(peak: int, retained: int, size: int) -> dict:
+    return {
+        "peak_mb": round(peak / 2 ** 20, 2),
+        "retained_mb": round(retained / 2 ** 20, 2),
+        "peak_per_entry": round(peak / size),
+        "retained_per_entry": round(retained / size),
+    }
+
+
+def measure_load(settings: dict, size: int) -> dict:
+    """Load the vault, then build the search index as Vault does. Load time is measured
+    without tracemalloc, which slows allocations down
+
+    Returns:
+        dict: {"load_ms", "vault": {...}, "index": {...}}, see memory_result
+    """
+    gc.collect()
+    start = time.perf_counter()
+    Totp(settings=settings)
+    elapsed = time.perf_counter() - start
+
+    app, peak, retained = traced(lambda: Totp(settings=settings))
+    assert len(app.otp_data.entries) == size
+    index, index_peak, index_retained = traced(lambda: SearchIndex(app.otp_data.entries))
+    del app, index
+    return {
+        "load_ms": round(elapsed * 1000, 2),
+        "vault": memory_result(peak, retained, size),
+        "index": memory_result(index_peak, index_retained, size),
+    }
+
+
+def bench_size(size: int) -> dict:
+    results = {}
+    config = generators.vault(size)
+    settings = {"otpauthLinks": ""}
+    for name, binary in (("json", False), ("binary", True)):
+        Files.set_binary(binary)
+        Files.save_storage(data=config)
+        results[name] = measure_load({**settings, "binaryStorage": binary}, size)
+    Files.set_binary(False)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--json", help="Write results to the file")
+    args = parser.parse_args()
+
+    Crypt.set_backend(backend=PortableBackend(master_key=b"\0" * 32))
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for size in (int(size) for size in args.sizes.split(",")):
+                results[str(size)] = bench_size(size)
+                for name, result in results[str(size)].items():
+                    for part in ("vault", "index"):
+                        memory = result[part]
+                        print(f"{size:>7} {name:<7} {part:<6} load {result['load_ms']:>9.2f} ms  "
+                              f"peak {memory['peak_mb']:>8.2f} MB ({memory['peak_per_entry']} B/entry)  "
+                              f"retained {memory['retained_mb']:>8.2f} MB ({memory['retained_per_entry']} B/entry)")
+        finally:
+            os.chdir(cwd)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Benchmark suite: vault load/save, settings import, migration decoding and query rendering
+
+Usage:
+    python benchmarks/run.py [--sizes 10,1000,10000] [--backend portable|plain|dpapi]
+                             [--json results.json] [--baseline baseline.json] [--threshold 1.25]
+
+Exit code is 1 if any benchmark is slower than baseline * threshold.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+from pathlib import Path
+
+plugindir = Path(__file__).absolute().parent.parent
+sys.path = [str(plugindir / p) for p in (".", "lib", "plugin")] + sys.path
+
+import generators  # noqa: E402
+import plugin  # noqa: E402
+from plugin.lib import Crypt, Files, Totp  # noqa: E402
+from plugin.lib.crypt import CryptBackend, PortableBackend  # noqa: E402
+from plugin.migration_decoder.decoder import decode  # noqa: E402
+
+
+class PlainBackend(CryptBackend):
+    """No encryption, measures the plugin without crypto cost"""
+
+    name = 'plain'
+
+    def protect(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def unprotect(self, blob: bytes) -> bytearray:
+        return bytearray(blob)
+
+
+def make_backend(name: str) -> CryptBackend:
+    if name == PlainBackend.name:
+        return PlainBackend()
+    if name == PortableBackend.name:
+        return PortableBackend(master_key=b"\0" * 32)
+    return None
+
+
+def measure(fn, repeat: int, setup=None) -> dict:
+    """Run fn repeat times, setup is not timed
+
+    Returns:
+        dict: {"median_ms", "min_ms", "repeat"}
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "min_ms": round(min(samples), 4),
+        "repeat": repeat,
+    }
+
+
+def set_request(query: str, settings: dict):
+    # pyflowlauncher reads the request from argv
+    sys.argv = [sys.argv[0], json.dumps(
+        {"method": "query", "parameters": [query], "settings": settings})]
+
+
+def remove_storage():
+    for path in ("OTPList.json", "OTPList.bin", "OTPList.journal"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def bench_size(size: int, repeat: int) -> dict:
+    results = {}
+    config = generators.vault(size)
+    links = generators.otpauth_links(min(size, 1000))
+    migrations = generators.migration_links(min(size, 1000))
+    settings = {"otpauthLinks": ""}
+
+    results["save_storage"] = measure(lambda: Files.save_storage(data=config), repeat)
+
+    app = Totp(settings=settings)
+    results["load_storage"] = measure(app.load_storage, repeat)
+
+    binary_app = Totp(settings={**settings, "binaryStorage": True})
+    results["save_storage_binary"] = measure(lambda: Files.save_storage(data=config), repeat)
+    results["load_storage_binary"] = measure(binary_app.load_storage, repeat)
+    Files.set_binary(False)
+
+    import_settings = {"otpauthLinks": "\n".join(links[:len(links) // 2] + migrations[len(migrations) // 2:])}
+    results["handle_auth_import"] = measure(
+        lambda: Totp(settings=import_settings), max(1, repeat // 5), setup=remove_storage)
+    results["handle_auth_import_repeat"] = measure(lambda: Totp(settings=import_settings), repeat)
+
+    results["decode"] = measure(lambda: [decode(link) for link in migrations], repeat)
+
+    # query on the benchmark vault, caches are warmed by the first call
+    Files.save_storage(data=config)
+    set_request("", settings)
+    plugin.query("")
+    results["query_empty"] = measure(lambda: plugin.query(""), repeat)
+    set_request("git", settings)
+    results["query_search"] = measure(lambda: plugin.query("git"), repeat)
+    set_request("?123456", settings)
+    results["query_verify"] = measure(lambda: plugin.query("?123456"), repeat)
+
+    plugin.vault.reset()
+    plugin.code_engine.clear()
+    plugin.secret_cache.clear()
+    set_request("", settings)
+    results["query_cold"] = measure(lambda: plugin.query(""), 1)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Benchmarks slower than baseline * threshold
+
+    Returns:
+        list: Messages
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base and result["median_ms"] > base["median_ms"] * threshold:
+            regressions.append(
+                f"{name}: {result['median_ms']:.3f} ms > {base['median_ms']:.3f} ms * {threshold}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,1000,10000")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--backend", default="portable", choices=("portable", "plain", "dpapi"))
+    parser.add_argument("--json", help="Write results into this file")
+    parser.add_argument("--baseline", help="Results file to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    Crypt.set_backend(backend=make_backend(args.backend), name=args.backend)
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+
+    workdir = os.getcwd()
+    for size in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                for name, result in bench_size(size, args.repeat).items():
+                    results["results"][f"{name}/{size}"] = result
+                    print(f"{name + '/' + str(size):32} {result['median_ms']:10.3f} ms")
+            finally:
+                os.chdir(workdir)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
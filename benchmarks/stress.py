@@ -0,0 +1,138 @@
+"""Multi-process stress test of the storage: importers add links while readers load the vault
+
+Usage:
+    python benchmarks/stress.py [--importers 4] [--readers 4] [--links 20] [--journal] [--binary]
+
+Every importer process adds its own links one by one (a new Totp per link, like Flow Launcher
+starts a process per query), readers load the vault in a loop. Exit code is 1 if any read
+failed or saw a torn file, or if the final vault misses an imported account.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+plugindir = Path(__file__).absolute().parent.parent
+sys.path = [str(plugindir / p) for p in (".", "lib", "plugin")] + sys.path
+
+import generators  # noqa: E402
+from plugin.lib import Files, Totp  # noqa: E402
+
+
+def worker_links(worker: int, count: int) -> list:
+    rng = random.Random(worker)
+    return [
+        f"otpauth://totp/Stress{worker}:account{i}?secret={generators.b32(generators.random_secret(rng))}"
+        f"&issuer=Stress{worker}"
+        for i in range(count)
+    ]
+
+
+def settings(links: list, args) -> dict:
+    return {
+        "otpauthLinks": "\n".join(links),
+        "storageJournal": args.journal,
+        "binaryStorage": args.binary,
+    }
+
+
+def importer(worker: int, workdir: str, args, errors):
+    os.chdir(workdir)
+    links = worker_links(worker, args.links)
+    for i in range(1, len(links) + 1):
+        try:
+            Totp(settings=settings(links[:i], args))
+        except Exception as e:
+            errors.put(f"importer {worker}: {e!r}")
+
+
+def reader(worker: int, workdir: str, args, errors, stop):
+    os.chdir(workdir)
+    Files.set_binary(args.binary)
+    reads = 0
+    while not stop.is_set():
+        try:
+            data = Files.read_otp_config()
+            if not isinstance(data.get('entries'), list):
+                errors.put(f"reader {worker}: entries are missing")
+            reads += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            errors.put(f"reader {worker}: {e!r}")
+    errors.put(f"reads {reads}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--importers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--links", type=int, default=20)
+    parser.add_argument("--journal", action="store_true", help="Append changes to the journal")
+    parser.add_argument("--binary", action="store_true", help="Binary OTPList.bin storage")
+    args = parser.parse_args()
+
+    # every process must use the same portable key
+    os.environ.setdefault("TOTP_CRYPT_BACKEND", "portable")
+    os.environ.setdefault("TOTP_PORTABLE_KEY", "stress")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        errors = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        readers = [multiprocessing.Process(target=reader, args=(i, workdir, args, errors, stop))
+                   for i in range(args.readers)]
+        importers = [multiprocessing.Process(target=importer, args=(i, workdir, args, errors))
+                     for i in range(args.importers)]
+
+        start = time.perf_counter()
+        for process in readers + importers:
+            process.start()
+        for process in importers:
+            process.join()
+        stop.set()
+        for process in readers:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        failures = []
+        reads = 0
+        while not errors.empty():
+            message = errors.get()
+            if message.startswith("reads "):
+                reads += int(message.split()[1])
+            else:
+                failures.append(message)
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            Files.set_binary(args.binary)
+            data = Files.read_otp_config()
+        finally:
+            os.chdir(cwd)
+        names = {entry['name'] for entry in data['entries']}
+        expected = {f"Stress{worker}:account{i}" for worker in range(args.importers) for i in range(args.links)}
+        missing = sorted(expected - names)
+        if missing:
+            failures.append(f"{len(missing)} accounts are missing, ex: {missing[:5]}")
+
+    print(json.dumps({
+        "seconds": round(elapsed, 3),
+        "imports": args.importers * args.links,
+        "reads": reads,
+        "accounts": len(names),
+        "failures": len(failures),
+    }))
+    for message in failures:
+        print(f"FAILED {message}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Headless entry point: exports codes as newline-delimited JSON, without Flow Launcher.
+
+Usage:
+    python cli.py [filter] [--limit N] [--time UNIX_TIME]   codes of matched accounts, one JSON object per line
+    python cli.py [filter] --watch                          the same, again at every time step boundary
+    python cli.py --name NAME [--time UNIX_TIME]            code of the account with exactly this name
+    python cli.py --import < links.txt                      import otpauth:// and otpauth-migration:// links
+
+Storage files are read from --dir, the plugin directory by default. Secrets are never written out.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import dataclasses
+from pathlib import Path
+
+plugindir = Path.absolute(Path(__file__).parent)
+paths = (".", "lib", "plugin")
+sys.path = [str(plugindir / p) for p in paths] + sys.path
+
+from plugin.lib import (  # noqa: E402
+    CodeEngine, CodeScheduler, FileWatcher, Files, InvalidSecretError, SecretCache, Totp, Vault
+)
+from plugin.lib.definitions import OTP_BINARY_PATH, OTP_CONFIG_PATH  # noqa: E402
+from plugin.lib.models import Entrie  # noqa: E402
+
+# types
+from typing import List, Optional
+
+
+def storage_settings(args: argparse.Namespace, links: Optional[str] = None) -> dict:
+    """Plugin settings for the storage in the current directory. Without --binary the format
+    of the existing files is kept, so the CLI never converts the storage
+
+    Args:
+        args (argparse.Namespace): Parsed arguments
+        links (Optional[str]): Links to import, one per line
+
+    Returns:
+        dict: Plugin settings
+    """
+    binary = args.binary or (os.path.exists(OTP_BINARY_PATH) and not os.path.exists(OTP_CONFIG_PATH))
+    return {
+        "otpauthLinks": links or "",
+        "storageJournal": args.journal,
+        "binaryStorage": binary,
+    }
+
+
+def code_record(scheduler: CodeScheduler, entry: Entrie, for_time: float) -> dict:
+    """JSON object of the entry code
+
+    Returns:
+        dict: {"name", "type", "code", ...}, or {"name", "type", "error"} if the key is broken
+    """
+    record = {"name": entry.name, "type": entry.type}
+    try:
+        code, remaining_seconds, next_code = scheduler.code(entry, for_time=for_time)
+    except InvalidSecretError as e:
+        record["error"] = str(e) or "Invalid OTP secret"
+        return record
+
+    record["code"] = code
+    if entry.type == 'hotp':
+        record["counter"] = entry.counter
+    else:
+        record["remaining"] = remaining_seconds
+        record["next"] = next_code
+        record["period"] = entry.period
+    return record
+
+
+def export(vault: Vault, scheduler: CodeScheduler, args: argparse.Namespace, for_time: float) -> List[Entrie]:
+    """Write codes of matched entries to stdout, in one write
+
+    Returns:
+        List[Entrie]: All entries of the vault
+    """
+    app = vault.get(settings=storage_settings(args))
+    entries = vault.index.search(args.filter, limit=args.limit)
+    scheduler.track(app.otp_data.entries)
+    scheduler.code_engine.preload(entries)
+    lines = [
+        json.dumps(code_record(scheduler, entry, for_time), separators=(',', ':'))
+        for entry in entries
+    ]
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
+    sys.stdout.flush()
+    return app.otp_data.entries
+
+
+def find_entry(args: argparse.Namespace) -> Optional[Entrie]:
+    """Entry with exactly the --name name. The binary vault is searched in place without loading it,
+    the storage is loaded only if it has to be (no config yet, unencrypted keys to encrypt)
+
+    Returns:
+        Optional[Entrie]: None if not found
+    """
+    settings = storage_settings(args)
+    Files.set_binary(settings["binaryStorage"])
+    try:
+        item = Files.find_entry(args.name)
+    except FileNotFoundError:
+        item = None
+    if item is not None and item["is_encrypted"]:
+        return Entrie.from_dict(item)
+    if item is None and os.path.exists(Files.config_path()):
+        return None
+    return Totp(settings=settings).index.get(args.name)
+
+
+def export_entry(scheduler: CodeScheduler, args: argparse.Namespace, for_time: float) -> int:
+    """Write code of the --name entry to stdout
+
+    Returns:
+        int: Exit code, 1 if there is no such entry
+    """
+    entry = find_entry(args)
+    if entry is None:
+        return 1
+    sys.stdout.write(json.dumps(code_record(scheduler, entry, for_time), separators=(',', ':')) + '\n')
+    sys.stdout.flush()
+    return 0
+
+
+def watch(vault: Vault, scheduler: CodeScheduler, args: argparse.Namespace):
+    """Export codes again at every time step boundary of the vault entries, until interrupted
+    """
+    vault.watcher.start()
+    scheduler.start()
+    try:
+        while True:
+            now = time.time()
+            export(vault, scheduler, args, for_time=now)
+            boundary = scheduler.next_boundary(now)
+            if boundary is None:
+                # only HOTP entries, their codes don't change with time
+                return
+            time.sleep(max(0.0, boundary - time.time()))
+    finally:
+        scheduler.stop()
+        vault.watcher.stop()
+
+
+def import_links(args: argparse.Namespace) -> int:
+    """Import links from stdin and write the import report as JSON
+
+    Returns:
+        int: Exit code, 1 if any link failed
+    """
+    links = sys.stdin.read()
+    app = Totp(settings=storage_settings(args, links=links))
+    report = dataclasses.asdict(app.import_report)
+    sys.stdout.write(json.dumps(report, separators=(',', ':')) + '\n')
+    return 1 if report['errors'] else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("filter", nargs="?", default="", help="Search query, all accounts by default")
+    parser.add_argument("--name", help="Exact account name, found without loading the whole vault")
+    parser.add_argument("--limit", type=int, default=0, help="Max count of accounts, 0 for all")
+    parser.add_argument("--time", type=float, default=None, help="Unix time of the codes, now by default")
+    parser.add_argument("--watch", action="store_true", help="Export fresh codes at every time step boundary")
+    parser.add_argument("--import", dest="import_links", action="store_true", help="Import links from stdin")
+    parser.add_argument("--dir", default=str(plugindir), help="Directory of the storage files")
+    parser.add_argument("--journal", action="store_true", help="Append changes to the journal")
+    parser.add_argument("--binary", action="store_true", help="Binary OTPList.bin storage")
+    args = parser.parse_args()
+    os.chdir(args.dir)
+
+    if args.import_links:
+        return import_links(args)
+
+    secret_cache = SecretCache()
+    code_engine = CodeEngine(secret_cache=secret_cache)
+    scheduler = CodeScheduler(code_engine=code_engine)
+    vault = Vault(watcher=FileWatcher())
+    for_time = time.time() if args.time is None else args.time
+    status = 0
+    try:
+        if args.name is not None:
+            status = export_entry(scheduler, args, for_time=for_time)
+        elif args.watch:
+            watch(vault, scheduler, args)
+        else:
+            export(vault, scheduler, args, for_time=for_time)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # reader of the stream is gone
+        sys.stderr.close()
+    finally:
+        scheduler.clear()
+        code_engine.clear()
+        secret_cache.clear()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,8 +10,12 @@ plugindir = Path.absolute(Path(__file__).parent)
 paths = (".", "lib", "plugin")
 sys.path = [str(plugindir / p) for p in paths] + sys.path
 
-# app
-from plugin import plugin
+import resident
 
+if len(sys.argv) > 1 and sys.argv[1] == resident.SERVE_ARG:
+    resident.serve()
+elif not resident.forward(sys.argv):
+    # app
+    from plugin import plugin
 
-plugin.run()
+    plugin.run()
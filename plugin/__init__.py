@@ -1,18 +1,136 @@
 import time
-import pyotp
+import atexit
 
 # libs
-from plugin.lib import Totp, Crypt, copy_to_clipboard
-from plugin.lib.definitions import APP_ICON, ERROR_ICON
+from plugin.lib import (
+    CodeEngine, CodeScheduler, FileWatcher, InvalidSecretError, SecretCache, UsageStore, Vault, copy_to_clipboard
+)
+from plugin.lib.definitions import (
+    APP_ICON, ERROR_ICON, MAX_RESULTS, NEXT_CODE_SECONDS, SECRET_CACHE_TTL, TOP_RESULTS_COUNT, VERIFY_PREFIX, VERIFY_WINDOW
+)
+from plugin.lib.instrument import timings
+from plugin.lib.models import Entrie
 
 # types
 from typing import Union, List
 
 # flow
-from pyflowlauncher import Plugin, Result, send_results
+from pyflowlauncher import Plugin, Result
 from pyflowlauncher.result import ResultResponse
 
 plugin = Plugin()
+watcher = FileWatcher()
+vault = Vault(watcher=watcher)
+secret_cache = SecretCache()
+code_engine = CodeEngine(secret_cache=secret_cache)
+scheduler = CodeScheduler(code_engine=code_engine)
+usage = UsageStore(watcher=watcher)
+atexit.register(secret_cache.clear)
+atexit.register(code_engine.clear)
+atexit.register(scheduler.clear)
+
+
+def get_number_setting(settings: dict, name: str, default: float) -> float:
+    """Read numeric value from plugin settings
+
+    Args:
+        settings (dict): Plugin settings
+        name (str): Setting name
+        default (float): Value if setting is empty or invalid
+
+    Returns:
+        float
+    """
+    try:
+        return float(settings.get(name) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+def respond(results: List[Union[Result, dict]], query: str) -> ResultResponse:
+    """Serialize results, with the timings row and log if debug timings are on
+
+    Args:
+        results (List[Union[Result, dict]]): Results, or rows already rendered by ResultCache
+        query (str): Query, for the log
+
+    Returns:
+        ResultResponse
+    """
+    with timings.phase('serialize'):
+        response = {
+            'result': [result if isinstance(result, dict) else result.as_dict() for result in results],
+            'SettingsChange': None
+        }
+    if not timings.enabled:
+        return response
+
+    summary = timings.summary()
+    try:
+        timings.log(f"query {query!r} | {summary}")
+    except OSError:
+        pass
+    response['result'].append(
+        Result(
+            Title="Debug timings",
+            SubTitle=summary,
+            IcoPath=APP_ICON,
+        ).as_dict()
+    )
+    return response
+
+
+def verify_results(code: str, entries: List[Entrie], window: int) -> List[Result]:
+    """Rows of entries which generate the code within the window of time steps
+
+    Args:
+        code (str): Typed code, spaces are ignored
+        entries (List[Entrie]): All entries
+        window (int): Time steps (HOTP counters) around the current one
+
+    Returns:
+        List[Result]
+    """
+    code = ''.join(code.split())
+    if not code.isdigit():
+        return [
+            Result(
+                Title=f"Type a code after {VERIFY_PREFIX} to find its account",
+                SubTitle=f"Accounts are checked within {window} time steps before and after the current one",
+                IcoPath=APP_ICON,
+            )
+        ]
+
+    code_engine.preload([entry for entry in entries if entry.digits == len(code)])
+    matches = code_engine.verify(entries, code, window=window)
+    if not matches:
+        return [
+            Result(
+                Title=f"{code} doesn't match any account",
+                SubTitle=f"Checked within {window} time steps before and after the current one",
+                IcoPath=ERROR_ICON,
+            )
+        ]
+
+    results = []
+    for entry, offset in matches:
+        if entry.type == 'hotp':
+            subtitle = f"HOTP code of counter {entry.counter + offset}"
+        elif offset == 0:
+            subtitle = "Current code"
+        elif offset < 0:
+            subtitle = f"Code of {-offset} time step(s) ago, {-offset * entry.period}s"
+        else:
+            subtitle = f"Code of {offset} time step(s) ahead, {offset * entry.period}s"
+        results.append(
+            Result(
+                Title=f"{code} - {entry.name}",
+                SubTitle=subtitle,
+                IcoPath=APP_ICON,
+            )
+        )
+    return results
+
 
 # @plugin.on_method
 # def context_menu(context_data):
@@ -27,10 +145,26 @@ plugin = Plugin()
 
 @plugin.on_method
 def query(query: str) -> ResultResponse:
-    results: Union[List[Result], List] = []
+    results: List[Union[Result, dict]] = []
     search_query = query.strip()
+    started = time.perf_counter()
+    # resident process keeps the previous request state until settings are read
+    timings.start(enabled=False)
     try:
-        app = Totp(settings=plugin.settings)
+        settings = plugin.settings
+        timings.start(
+            enabled=str(settings.get('debugTimings', False)).lower() == 'true', started=started)
+        timings.add('settings_parse', started)
+        with timings.phase('load'):
+            app = vault.get(settings=settings)
+        secret_cache.ttl = get_number_setting(
+            settings, 'secretCacheTtl', SECRET_CACHE_TTL)
+        top_count = int(get_number_setting(
+            settings, 'topResultsCount', TOP_RESULTS_COUNT))
+        limit = int(get_number_setting(
+            settings, 'maxResults', MAX_RESULTS))
+        if not search_query and top_count > 0:
+            limit = min(limit, top_count) if limit > 0 else top_count
     except:
         results.append(
             Result(
@@ -39,26 +173,69 @@ def query(query: str) -> ResultResponse:
                 IcoPath=ERROR_ICON,
             )
         )
-        return send_results(results)
+        return respond(results, search_query)
 
-    if len(app.otp_data.entries) > 0:
-        for totp_entry in app.otp_data.entries:
-            if search_query and search_query.lower() not in totp_entry.name.lower():
-                continue
+    # every load retries failed links, they are reported with any query until fixed
+    report = app.import_report
+    for error in report.errors:
+        where = f"line {error.line}" if error.source == 'settings' else f"unencrypted entry {error.line} of the storage"
+        results.append(
+            Result(
+                Title=f"Import failed on {where}: {error.link}",
+                SubTitle=f"{error.stage}: {error.message}",
+                IcoPath=ERROR_ICON,
+            )
+        )
+    if report.missing_parts:
+        results.append(
+            Result(
+                Title=f"Migration export is incomplete",
+                SubTitle=f"{report.missing_parts} QR codes of a multi QR export are missing in settings",
+                IcoPath=ERROR_ICON,
+            )
+        )
 
-            try:
-                key = Crypt.decrypt_key(totp_entry.key)
-            except:
-                results.append(
-                    Result(
-                        Title=f"Something wrong!",
-                        SubTitle=f"With decrypt '{totp_entry.key}' key!",
-                        IcoPath=ERROR_ICON,
-                    )
+    if len(app.otp_data.entries) > 0 and search_query.startswith(VERIFY_PREFIX):
+        window = int(get_number_setting(settings, 'verifyWindow', VERIFY_WINDOW))
+        try:
+            with timings.phase('verify'):
+                results.extend(verify_results(search_query[len(VERIFY_PREFIX):], app.otp_data.entries, window))
+        except:
+            results.append(
+                Result(
+                    Title=f"Something wrong!",
+                    SubTitle=f"Code check failed to decrypt keys",
+                    IcoPath=ERROR_ICON,
                 )
-                return send_results(results)
+            )
+        return respond(results, search_query)
 
-            if not app.check_key_valid(key):
+    if len(app.otp_data.entries) > 0:
+        try:
+            usage.load()
+        except OSError:
+            # ranking is optional, keep file order
+            pass
+        now = time.time()
+        with timings.phase('filter'):
+            entries = vault.index.search(
+                search_query, usage=lambda entry: usage.score(entry.name, now=now), limit=limit)
+        scheduler.track(app.otp_data.entries)
+        # codes of the table don't touch the generators, idle keys are wiped here
+        code_engine.expire()
+
+        try:
+            with timings.phase('decrypt'):
+                code_engine.preload(entries)
+        except:
+            # broken key will be reported by its own row below
+            pass
+
+        for totp_entry in entries:
+            try:
+                with timings.phase('codes'):
+                    code, remaining_seconds, next_code = scheduler.code(totp_entry, for_time=now)
+            except InvalidSecretError:
                 results.append(
                     Result(
                         Title=f"{totp_entry.name}: Invalid OTP secret",
@@ -66,21 +243,24 @@ def query(query: str) -> ResultResponse:
                         IcoPath=ERROR_ICON,
                     )
                 )
-            else:
-                totp = pyotp.TOTP(key)
-                remaining_seconds = totp.interval - \
-                    int(time.time()) % totp.interval
+                continue
+            except:
                 results.append(
                     Result(
-                        Title=f"{totp.now()} - {totp_entry.name}",
-                        SubTitle=f"Copy to clipboard - Expires in {remaining_seconds}s",
-                        IcoPath=APP_ICON,
-                        JsonRPCAction={
-                            "Method": "copy_to_clipboard",
-                            "Parameters": [totp.now()]
-                        }
+                        Title=f"Something wrong!",
+                        SubTitle=f"With decrypt '{totp_entry.name}' key!",
+                        IcoPath=ERROR_ICON,
                     )
                 )
+                return respond(results, search_query)
+
+            if totp_entry.type == 'hotp':
+                subtitle = f"Copy to clipboard - Counter {totp_entry.counter}"
+            else:
+                subtitle = f"Copy to clipboard - Expires in {remaining_seconds}s"
+                if remaining_seconds <= NEXT_CODE_SECONDS:
+                    subtitle += f" - Next {next_code}"
+            results.append(vault.rows.row(totp_entry, code, subtitle))
     else:
         results.append(
             Result(
@@ -90,7 +270,19 @@ def query(query: str) -> ResultResponse:
             )
         )
 
-    return send_results(results)
+    return respond(results, search_query)
+
+
+@plugin.on_method
+def copy_hotp_to_clipboard(text: str, name: str):
+    """Copy HOTP code to clipboard and move the entry to the next counter
+
+    Args:
+        text (str): Code
+        name (str): Name of key
+    """
+    copy_to_clipboard(text, name=name)
+    vault.get(settings=plugin.settings).increment_counter(name=name)
 
 
 plugin.add_method(copy_to_clipboard)
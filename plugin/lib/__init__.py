@@ -1,11 +1,39 @@
+from .binary_vault import BinaryVault
+from .codes import CodeEngine, InvalidSecretError, OtpGenerator
 from .crypt import Crypt
+from .entry_index import EntryIndex
 from .files import Files
+from .importer import Importer
+from .instrument import Timings
+from .locks import FileLock
+from .precompute import CodeScheduler
+from .render import ResultCache
+from .search import SearchIndex
+from .secret_cache import SecretCache
 from .totp import Totp
+from .usage import UsageStore
 from .utils import copy_to_clipboard
+from .vault import Vault
+from .watcher import FileWatcher
 
 __all__ = [
+    "BinaryVault",
+    "CodeEngine",
+    "CodeScheduler",
+    "InvalidSecretError",
+    "OtpGenerator",
     "Crypt",
+    "EntryIndex",
     "Files",
+    "FileLock",
+    "Importer",
+    "Timings",
+    "ResultCache",
+    "SearchIndex",
+    "SecretCache",
     "Totp",
-    "copy_to_clipboard"
+    "UsageStore",
+    "copy_to_clipboard",
+    "Vault",
+    "FileWatcher"
 ]
@@ -0,0 +1,256 @@
+import os
+import mmap
+import base64
+import binascii
+import struct
+from contextlib import contextmanager
+
+# libs
+from plugin.lib.definitions import OTP_ALGORITHMS, OTP_BINARY_VERSION
+from plugin.lib.instrument import timings
+
+# types
+from typing import Iterator, Optional
+
+MAGIC = b"OTPB"
+"""First bytes of binary vault file
+"""
+
+HEADER = struct.Struct("<4sHHIIIII32s")
+"""magic, format version, config version, entries count, imported count,
+names offset, imported offset, blobs offset, salt (hex, zero padded)
+"""
+
+RECORD = struct.Struct("<QIIHBBBBIQ16s")
+"""Offset table record of one entry: blob offset, blob size, name offset (in names),
+name size, type, algorithm, digits, flags, period, counter, fingerprint
+"""
+
+NAME_INDEX = struct.Struct("<I")
+"""Name index item: entry position, items are sorted by entry name
+"""
+
+IMPORTED_SIZE = 32
+"""Size of raw sha256 import ledger fingerprint
+"""
+
+FLAG_ENCRYPTED = 1
+"""Record flag: blob is encrypted key, otherwise plain key text
+"""
+
+FLAG_FINGERPRINT = 2
+"""Record flag: record has secret fingerprint
+"""
+
+TYPES = ('totp', 'hotp')
+"""Record type values
+"""
+
+ALGORITHMS = tuple(OTP_ALGORITHMS)
+"""Record algorithm values
+"""
+
+
+class BinaryVault:
+    """Versioned binary storage of OtpConfig data:
+
+        header | offset table | name index | names | import ledger | key blobs
+
+    Encrypted keys are stored as raw bytes, not base64. The file is memory mapped,
+    so a name is looked up without reading key blobs
+    """
+
+    @staticmethod
+    @contextmanager
+    def mapped(path: str) -> Iterator[mmap.mmap]:
+        """Map vault file into memory and check its header
+
+        Raises:
+            ValueError: If the file is not a binary vault of known version
+        """
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                if len(view) < HEADER.size or view[:len(MAGIC)] != MAGIC:
+                    raise ValueError(f"{path} is not a binary vault")
+                version = HEADER.unpack_from(view)[1]
+                if version != OTP_BINARY_VERSION:
+                    raise ValueError(f"Unsupported binary vault version {version}")
+                yield view
+
+    @staticmethod
+    def is_binary(path: str) -> bool:
+        """Check magic bytes of the file
+
+        Returns:
+            bool
+        """
+        try:
+            with open(path, "rb") as f:
+                return f.read(len(MAGIC)) == MAGIC
+        except OSError:
+            return False
+
+    @staticmethod
+    def read(path: str, raw_keys: bool = False) -> dict:
+        """Read the whole vault in one pass over the offset table
+
+        Args:
+            path (str): Vault file
+            raw_keys (bool): Encrypted keys are raw bytes instead of base64 strings, for Entrie.from_dict
+
+        Returns:
+            dict: Raw config data, the same as OTPList.json contains
+        """
+        with BinaryVault.mapped(path) as view:
+            (_, _, version, count, imported_count,
+             names_offset, imported_offset, _, salt) = HEADER.unpack_from(view)
+            records = RECORD.iter_unpack(view[HEADER.size:HEADER.size + RECORD.size * count])
+            entries = [BinaryVault.entry(view, names_offset, record, raw_keys=raw_keys) for record in records]
+            imported = view[imported_offset:imported_offset + IMPORTED_SIZE * imported_count].hex()
+
+        return {
+            'version': version,
+            'entries': entries,
+            'imported': [imported[i:i + IMPORTED_SIZE * 2]
+                         for i in range(0, len(imported), IMPORTED_SIZE * 2)],
+            'salt': salt.rstrip(b"\0").decode('ascii'),
+        }
+
+    @staticmethod
+    def entry(view: mmap.mmap, names_offset: int, record: tuple, raw_keys: bool = False) -> dict:
+        """Raw entry data of offset table record
+
+        Args:
+            view (mmap.mmap): Mapped vault
+            names_offset (int): Offset of names
+            record (tuple): Offset table record
+            raw_keys (bool): Encrypted key is raw bytes instead of base64 string
+
+        Returns:
+            dict: Entrie fields
+        """
+        (blob_offset, blob_size, name_offset, name_size, type_id,
+         algorithm_id, digits, flags, period, counter, fingerprint) = record
+        blob = view[blob_offset:blob_offset + blob_size]
+        name_offset += names_offset
+        if not flags & FLAG_ENCRYPTED:
+            key = blob.decode('utf-8')
+        elif raw_keys:
+            key = blob
+        else:
+            key = binascii.b2a_base64(blob, newline=False).decode('ascii')
+        return {
+            'name': view[name_offset:name_offset + name_size].decode('utf-8'),
+            'key': key,
+            'is_encrypted': bool(flags & FLAG_ENCRYPTED),
+            'type': TYPES[type_id],
+            'algorithm': ALGORITHMS[algorithm_id],
+            'digits': digits,
+            'period': period,
+            'counter': counter,
+            'fingerprint': fingerprint.hex() if flags & FLAG_FINGERPRINT else '',
+        }
+
+    @staticmethod
+    def find(path: str, name: str, raw_keys: bool = False) -> Optional[dict]:
+        """Binary search of the entry in the name index, other key blobs are not touched
+
+        Args:
+            path (str): Vault file
+            name (str): Exact entry name
+            raw_keys (bool): Encrypted key is raw bytes instead of base64 string
+
+        Returns:
+            Optional[dict]: Entrie fields, None if not found
+        """
+        target = name.encode('utf-8')
+        with BinaryVault.mapped(path) as view:
+            header = HEADER.unpack_from(view)
+            count, names_offset = header[3], header[5]
+            index_offset = HEADER.size + RECORD.size * count
+
+            def record_at(i: int) -> tuple:
+                position = NAME_INDEX.unpack_from(view, index_offset + NAME_INDEX.size * i)[0]
+                return RECORD.unpack_from(view, HEADER.size + RECORD.size * position)
+
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                record = record_at(middle)
+                start = names_offset + record[2]
+                if view[start:start + record[3]] < target:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == count:
+                return None
+            entry = BinaryVault.entry(view, names_offset, record_at(low), raw_keys=raw_keys)
+            return entry if entry['name'] == name else None
+
+    @staticmethod
+    def dump(data: dict) -> bytes:
+        """Serialize raw config data
+
+        Args:
+            data (dict): Raw config data, see OtpConfig.to_dict
+
+        Returns:
+            bytes: Vault file content
+        """
+        entries = data.get('entries', [])
+        imported = data.get('imported', [])
+        names = [entry['name'].encode('utf-8') for entry in entries]
+        blobs = [base64.b64decode(entry['key']) if entry['is_encrypted'] else entry['key'].encode('utf-8')
+                 for entry in entries]
+
+        names_offset = HEADER.size + (RECORD.size + NAME_INDEX.size) * len(entries)
+        imported_offset = names_offset + sum(len(name) for name in names)
+        blobs_offset = imported_offset + IMPORTED_SIZE * len(imported)
+
+        records = []
+        name_offset = 0
+        blob_offset = blobs_offset
+        for entry, name, blob in zip(entries, names, blobs):
+            flags = FLAG_ENCRYPTED if entry['is_encrypted'] else 0
+            if entry.get('fingerprint'):
+                flags |= FLAG_FINGERPRINT
+            records.append(RECORD.pack(
+                blob_offset, len(blob), name_offset, len(name),
+                TYPES.index(entry.get('type', 'totp')),
+                ALGORITHMS.index(entry.get('algorithm', 'SHA1').upper()),
+                entry.get('digits', 6), flags, entry.get('period', 30), entry.get('counter', 0),
+                bytes.fromhex(entry.get('fingerprint') or '')
+            ))
+            name_offset += len(name)
+            blob_offset += len(blob)
+
+        name_index = sorted(range(len(entries)), key=names.__getitem__)
+        header = HEADER.pack(
+            MAGIC, OTP_BINARY_VERSION, data.get('version', 1), len(entries), len(imported),
+            names_offset, imported_offset, blobs_offset, data.get('salt', '').encode('ascii')
+        )
+        return b"".join([
+            header,
+            *records,
+            *(NAME_INDEX.pack(position) for position in name_index),
+            *names,
+            *(bytes.fromhex(fingerprint) for fingerprint in imported),
+            *blobs,
+        ])
+
+    @staticmethod
+    def write_atomic(path: str, data: dict):
+        """Write vault into temp file and replace the target with it
+
+        Args:
+            path (str): Vault file
+            data (dict): Raw config data, see OtpConfig.to_dict
+        """
+        timings.count('disk_writes')
+        content = BinaryVault.dump(data)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
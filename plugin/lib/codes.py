@@ -0,0 +1,339 @@
+import hmac
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+# libs
+from plugin.lib.crypt import Crypt
+from plugin.lib.secret_cache import SecretCache
+from plugin.lib.definitions import OTP_ALGORITHMS, VERIFY_WINDOW
+from plugin.lib.models import Entrie
+
+# types
+from typing import Callable, Iterable, List, Optional, Tuple
+
+GeneratorKey = Tuple[bytes, str, int, int]
+"""(encrypted key, algorithm, digits, period) of an entry
+"""
+
+
+class InvalidSecretError(ValueError):
+    """Secret can't be decoded as base32 data
+    """
+
+
+class OtpGenerator:
+    """Precomputed OTP generator. Keeps decoded key bytes, digest settings and the HMAC
+    keyed once with them, the code is memoized per counter (TOTP time step or HOTP counter).
+
+    wipe() zeroes only the key buffer. The keyed HMAC keeps the ipad/opad hash states derived
+    from the key inside hashlib, they can't be overwritten and are only dropped with the object,
+    as are the immutable bytes base64.b32decode returns in decode_secret
+    """
+
+    __slots__ = ('key', 'digest', 'digits', 'interval', '_mac', '_counter', '_code')
+
+    def __init__(self, key: bytearray, digest: Callable = hashlib.sha1, digits: int = 6, interval: int = 30):
+        """
+        Args:
+            key (bytearray): Decoded secret
+            digest (Callable): hashlib constructor
+            digits (int): Code length
+            interval (int): Time step in seconds
+        """
+        self.key = key
+        self.digest = digest
+        self.digits = digits
+        self.interval = interval
+        self._mac: Optional[hmac.HMAC] = None
+        self._counter: Optional[int] = None
+        self._code = ''
+
+    @staticmethod
+    def decode_secret(secret: bytearray) -> bytearray:
+        """Decode base32 secret, it's normalized like for its fingerprint (see Crypt.normalize_secret)
+
+        Args:
+            secret (bytearray): Base32 secret
+
+        Raises:
+            InvalidSecretError: If the secret is not base32 data
+
+        Returns:
+            bytearray: Key bytes
+        """
+        padded = Crypt.normalize_secret(secret)
+        missing_padding = len(padded) % 8
+        if missing_padding:
+            padded += b'=' * (8 - missing_padding)
+        try:
+            return bytearray(base64.b32decode(padded))
+        except ValueError as e:
+            raise InvalidSecretError(str(e)) from None
+        finally:
+            SecretCache.wipe(padded)
+
+    def counter(self, for_time: float) -> int:
+        return int(for_time) // self.interval
+
+    def remaining_seconds(self, for_time: float) -> int:
+        return self.interval - int(for_time) % self.interval
+
+    def keyed(self) -> hmac.HMAC:
+        """HMAC with the inner and outer hashes already keyed, copied for every code instead of keying again
+
+        Returns:
+            hmac.HMAC
+        """
+        if self._mac is None:
+            self._mac = hmac.new(self.key, digestmod=self.digest)
+        return self._mac
+
+    def generate(self, counter: int) -> str:
+        """Generate code for the time step counter (RFC 4226 dynamic truncation)
+
+        Args:
+            counter (int): Time step counter
+
+        Returns:
+            str: Code
+        """
+        mac = self.keyed().copy()
+        mac.update(counter.to_bytes(8, 'big'))
+        hmac_hash = mac.digest()
+        offset = hmac_hash[-1] & 0xf
+        code = int.from_bytes(hmac_hash[offset:offset + 4], 'big') & 0x7fffffff
+        return str(code % 10 ** self.digits).zfill(self.digits)
+
+    def at_counter(self, counter: int) -> str:
+        """Code for the counter, computed once while the counter is the same
+
+        Args:
+            counter (int): TOTP time step or HOTP counter
+
+        Returns:
+            str: Code
+        """
+        if counter != self._counter:
+            self._code = self.generate(counter)
+            self._counter = counter
+        return self._code
+
+    def find(self, code: str, counter: int, offsets: Iterable[int]) -> Optional[int]:
+        """Find the counter which generates the code
+
+        Args:
+            code (str): Code to check
+            counter (int): Base TOTP time step or HOTP counter
+            offsets (Iterable[int]): Offsets from the base counter, checked in order
+
+        Returns:
+            Optional[int]: The first matched offset, None if no counter matches
+        """
+        for offset in offsets:
+            if counter + offset >= 0 and hmac.compare_digest(self.generate(counter + offset), code):
+                return offset
+        return None
+
+    def at(self, for_time: float) -> str:
+        """Code for the moment, computed once per time step
+
+        Args:
+            for_time (float): Unix time
+
+        Returns:
+            str: Code
+        """
+        return self.at_counter(self.counter(for_time))
+
+    def wipe(self):
+        """Wipe key bytes and memoized code
+        """
+        SecretCache.wipe(self.key)
+        self._mac = None
+        self._counter = None
+        self._code = ''
+
+
+class CodeEngine:
+    """Builds OtpGenerator once per encrypted key and code settings and keeps it while it is used.
+    Generators idle for longer than the secret cache TTL are wiped on the next get or expire call
+    """
+
+    def __init__(self, secret_cache: SecretCache):
+        """
+        Args:
+            secret_cache (SecretCache): Source of decrypted keys
+        """
+        self.secret_cache = secret_cache
+        self._generators: "OrderedDict[GeneratorKey, Tuple[OtpGenerator, float]]" = OrderedDict()
+        """Generators in the order of last use, the least recently used first
+        """
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def generator_key(entry: Entrie) -> GeneratorKey:
+        """Entries with the same secret but other algorithm, digits or period need their own generator
+
+        Returns:
+            GeneratorKey
+        """
+        return entry.key, entry.algorithm, entry.digits, entry.period
+
+    def get(self, entry: Entrie) -> OtpGenerator:
+        """Get generator of the entry, decrypt and decode the key only on first use
+
+        Args:
+            entry (Entrie): Entry with encrypted key
+
+        Raises:
+            InvalidSecretError: If decrypted key is not base32 data
+
+        Returns:
+            OtpGenerator
+        """
+        generator_key = self.generator_key(entry)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._generators.get(generator_key)
+            if item is not None:
+                self._generators[generator_key] = (item[0], now)
+                self._generators.move_to_end(generator_key)
+                return item[0]
+
+        digest = OTP_ALGORITHMS.get(entry.algorithm.upper())
+        if digest is None:
+            raise InvalidSecretError(f"Unsupported algorithm '{entry.algorithm}'")
+
+        generator = OtpGenerator(
+            key=OtpGenerator.decode_secret(self.secret_cache.get(entry.key)),
+            digest=digest,
+            digits=entry.digits,
+            interval=entry.period
+        )
+        with self._lock:
+            item = self._generators.get(generator_key)
+            if item is not None:
+                # built by another thread meanwhile, which may already use it
+                generator.wipe()
+                generator = item[0]
+            self._generators[generator_key] = (generator, time.monotonic())
+            self._generators.move_to_end(generator_key)
+        return generator
+
+    def peek(self, entry: Entrie) -> Optional[OtpGenerator]:
+        """Get already built generator of the entry, without decrypting the key or extending its lifetime
+
+        Args:
+            entry (Entrie): Entry with encrypted key
+
+        Returns:
+            Optional[OtpGenerator]: None if the generator is not built or expired
+        """
+        with self._lock:
+            item = self._generators.get(self.generator_key(entry))
+        if item is None or time.monotonic() - item[1] >= self.secret_cache.ttl:
+            return None
+        return item[0]
+
+    def preload(self, entries: List[Entrie]):
+        """Build all missing generators, keys are decrypted in batches of the secret cache size.
+        Generators of a batch are built before the next batch is decrypted, so its keys are not
+        evicted from the cache and decrypted again. Entries with invalid secrets are skipped, get() raises for them
+
+        Args:
+            entries (List[Entrie]): Entries with encrypted keys
+        """
+        with self._lock:
+            missing = [entry for entry in entries
+                       if self.generator_key(entry) not in self._generators]
+        size = max(1, self.secret_cache.max_size)
+        for start in range(0, len(missing), size):
+            batch = missing[start:start + size]
+            self.secret_cache.preload([entry.key for entry in batch])
+            for entry in batch:
+                try:
+                    self.get(entry)
+                except InvalidSecretError:
+                    continue
+
+    def code(self, entry: Entrie, for_time: Optional[float] = None) -> Tuple[str, Optional[int]]:
+        """Current code of the entry
+
+        Args:
+            entry (Entrie): Entry with encrypted key
+            for_time (Optional[float]): Unix time, now by default
+
+        Returns:
+            Tuple[str, Optional[int]]: (code, remaining_seconds). remaining_seconds is None for HOTP entries
+        """
+        generator = self.get(entry)
+        if entry.type == 'hotp':
+            return generator.at_counter(entry.counter), None
+
+        if for_time is None:
+            for_time = time.time()
+        return generator.at(for_time), generator.remaining_seconds(for_time)
+
+    def verify(self, entries: List[Entrie], code: str, for_time: Optional[float] = None,
+               window: int = VERIFY_WINDOW) -> List[Tuple[Entrie, int]]:
+        """Find entries which generate the code within the window of counters.
+        TOTP entries are checked from window steps ago to window steps ahead, HOTP entries
+        from the current counter to window counters ahead. Keys must be preloaded
+
+        Args:
+            entries (List[Entrie]): Entries with encrypted keys
+            code (str): Code to check
+            for_time (Optional[float]): Unix time, now by default
+            window (int): Count of time steps or counters around the current one
+
+        Returns:
+            List[Tuple[Entrie, int]]: (entry, offset of the matched counter), the nearest offsets first.
+                Entries with invalid secrets are skipped
+        """
+        if for_time is None:
+            for_time = time.time()
+        totp_offsets = sorted(range(-window, window + 1), key=abs)
+        matches = []
+        for entry in entries:
+            if entry.digits != len(code):
+                continue
+            try:
+                generator = self.get(entry)
+            except InvalidSecretError:
+                continue
+            if entry.type == 'hotp':
+                offset = generator.find(code, entry.counter, range(window + 1))
+            else:
+                offset = generator.find(code, generator.counter(for_time), totp_offsets)
+            if offset is not None:
+                matches.append((entry, offset))
+        matches.sort(key=lambda match: abs(match[1]))
+        return matches
+
+    def expire(self):
+        """Wipe generators which was not used for secret cache TTL
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+
+    def _expire(self, now: float):
+        """Wipe generators which was not used for secret cache TTL, the lock must be held
+        """
+        while self._generators:
+            generator_key, (generator, last_used) = next(iter(self._generators.items()))
+            if now - last_used < self.secret_cache.ttl:
+                break
+            del self._generators[generator_key]
+            generator.wipe()
+
+    def clear(self):
+        """Wipe all generators
+        """
+        with self._lock:
+            for generator, _ in self._generators.values():
+                generator.wipe()
+            self._generators.clear()
@@ -1,12 +1,28 @@
+import os
+import sys
+import hmac
 import base64
 import ctypes
-import pyotp
+import hashlib
+from abc import ABC, abstractmethod
+
+# libs
+from plugin.lib.definitions import (
+    CRYPT_BACKEND_ENV,
+    CRYPT_WORKERS,
+    CRYPT_PARALLEL_MIN,
+    PORTABLE_KEY_ENV,
+    PORTABLE_KEY_PATH,
+    PORTABLE_KEY_ITERATIONS,
+)
+from plugin.lib.instrument import timings
 
 # types
-from typing import Tuple
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
 
-crypt32 = ctypes.WinDLL('crypt32.dll')
-kernel32 = ctypes.WinDLL('kernel32.dll')
+BASE32_UPPER = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+"""Translation table of base32 secrets to upper case
+"""
 
 
 class DATA_BLOB(ctypes.Structure):
@@ -16,10 +32,278 @@ class DATA_BLOB(ctypes.Structure):
     ]
 
 
+class CryptBackend(ABC):
+    """Base class of encryption backends used by Crypt
+    """
+
+    name = ''
+    """Backend name for CRYPT_BACKEND_ENV
+    """
+
+    @abstractmethod
+    def protect(self, data: bytes) -> bytes:
+        """Encrypt raw bytes
+
+        Args:
+            data (bytes): Unencrypted data
+
+        Returns:
+            bytes: Encrypted blob
+        """
+
+    @abstractmethod
+    def unprotect(self, blob: bytes) -> bytearray:
+        """Decrypt raw bytes into a mutable buffer
+
+        Args:
+            blob (bytes): Encrypted blob
+
+        Returns:
+            bytearray: Decrypted data
+        """
+
+    def protect_many(self, items: List[bytes]) -> List[bytes]:
+        """Encrypt list of raw bytes in one pass
+
+        Args:
+            items (List[bytes]): Unencrypted data
+
+        Returns:
+            List[bytes]: Encrypted blobs in the same order
+        """
+        return [self.protect(data) for data in items]
+
+    def unprotect_many(self, blobs: List[bytes]) -> List[bytearray]:
+        """Decrypt list of raw bytes in one pass
+
+        Args:
+            blobs (List[bytes]): Encrypted blobs
+
+        Returns:
+            List[bytearray]: Decrypted data in the same order. If a blob fails, the data decrypted before it is wiped
+        """
+        result = []
+        try:
+            for blob in blobs:
+                result.append(self.unprotect(blob))
+        except BaseException:
+            Crypt.wipe_buffers(result)
+            raise
+        return result
+
+
+class DpapiBackend(CryptBackend):
+    """Windows DPAPI, data is bound to the current user account. DLLs are loaded on first use
+    """
+
+    name = 'dpapi'
+
+    def __init__(self):
+        self._crypt32 = None
+        self._kernel32 = None
+
+    def load(self):
+        """Load crypt32.dll and kernel32.dll
+        """
+        if self._crypt32 is None:
+            self._kernel32 = ctypes.WinDLL('kernel32.dll')
+            self._crypt32 = ctypes.WinDLL('crypt32.dll')
+
+    def protect(self, data: bytes) -> bytes:
+        return self.protect_many([data])[0]
+
+    def unprotect(self, blob: bytes) -> bytearray:
+        return self.unprotect_many([blob])[0]
+
+    def protect_many(self, items: List[bytes]) -> List[bytes]:
+        self.load()
+        # one input buffer for the whole batch, wiped at the end
+        size = max((len(data) for data in items), default=0)
+        buffer = ctypes.create_string_buffer(size or 1)
+        data_in = DATA_BLOB(0, ctypes.cast(buffer, ctypes.POINTER(ctypes.c_ubyte)))
+        encrypted = DATA_BLOB()
+
+        result = []
+        try:
+            for data in items:
+                ctypes.memmove(buffer, data, len(data))
+                data_in.cbData = len(data)
+
+                # Call the CryptProtectData function
+                if not self._crypt32.CryptProtectData(ctypes.byref(data_in), None, None, None, None, 0, ctypes.byref(encrypted)):
+                    raise ctypes.WinError()
+                result.append(ctypes.string_at(
+                    encrypted.pbData, encrypted.cbData))
+                self._kernel32.LocalFree(encrypted.pbData)
+        finally:
+            ctypes.memset(buffer, 0, size)
+        return result
+
+    def unprotect_many(self, blobs: List[bytes]) -> List[bytearray]:
+        self.load()
+        size = max((len(blob) for blob in blobs), default=0)
+        buffer = ctypes.create_string_buffer(size or 1)
+        data = DATA_BLOB(0, ctypes.cast(buffer, ctypes.POINTER(ctypes.c_ubyte)))
+        decrypted = DATA_BLOB()
+
+        result = []
+        try:
+            for blob in blobs:
+                ctypes.memmove(buffer, blob, len(blob))
+                data.cbData = len(blob)
+
+                # Call the CryptUnprotectData function
+                if not self._crypt32.CryptUnprotectData(ctypes.byref(data), None, None, None, None, 0, ctypes.byref(decrypted)):
+                    raise ctypes.WinError()
+                result.append(bytearray(ctypes.cast(
+                    decrypted.pbData, ctypes.POINTER(ctypes.c_ubyte * decrypted.cbData)).contents))
+                ctypes.memset(decrypted.pbData, 0, decrypted.cbData)
+                self._kernel32.LocalFree(decrypted.pbData)
+        except BaseException:
+            # keys decrypted before the failed blob are not returned, so they are wiped here
+            Crypt.wipe_buffers(result)
+            raise
+        return result
+
+
+class PortableBackend(CryptBackend):
+    """Pure python backend for non Windows systems (tests, benchmarks). Every call derives
+    a per-blob key with PBKDF2, like DPAPI derives one from the user master key,
+    encrypts with an HMAC-SHA256 keystream and authenticates with HMAC-SHA256.
+    The master key is read from PORTABLE_KEY_ENV or from PORTABLE_KEY_PATH file
+    """
+
+    name = 'portable'
+
+    VERSION = b'\x01'
+    NONCE_SIZE = 16
+    TAG_SIZE = 32
+
+    def __init__(self, master_key: Optional[bytes] = None, iterations: int = PORTABLE_KEY_ITERATIONS):
+        self._master_key = master_key
+        self.iterations = iterations
+
+    @staticmethod
+    def read_master_key() -> bytes:
+        """Read master key from environment or key file, create the file if needed
+
+        Returns:
+            bytes
+        """
+        env_key = os.environ.get(PORTABLE_KEY_ENV)
+        if env_key:
+            return hashlib.sha256(env_key.encode('utf-8')).digest()
+
+        try:
+            with open(PORTABLE_KEY_PATH, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            key = os.urandom(32)
+            fd = os.open(PORTABLE_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(key)
+            return key
+
+    @property
+    def master_key(self) -> bytes:
+        if self._master_key is None:
+            self._master_key = self.read_master_key()
+        return self._master_key
+
+    def derive_keys(self, nonce: bytes) -> Tuple[bytes, bytes]:
+        """Derive encryption and mac keys for one blob
+
+        Returns:
+            Tuple[bytes, bytes]: (enc_key, mac_key)
+        """
+        derived = hashlib.pbkdf2_hmac(
+            'sha256', self.master_key, nonce, self.iterations, dklen=64)
+        return derived[:32], derived[32:]
+
+    @staticmethod
+    def keystream(enc_key: bytes, nonce: bytes, size: int) -> bytes:
+        blocks = []
+        for counter in range((size + 31) // 32):
+            blocks.append(hmac.new(enc_key, nonce + counter.to_bytes(4, 'big'),
+                                   hashlib.sha256).digest())
+        return b''.join(blocks)[:size]
+
+    def protect(self, data: bytes) -> bytes:
+        nonce = os.urandom(self.NONCE_SIZE)
+        enc_key, mac_key = self.derive_keys(nonce)
+        stream = self.keystream(enc_key, nonce, len(data))
+        encrypted = bytes(a ^ b for a, b in zip(data, stream))
+        header = self.VERSION + nonce
+        tag = hmac.new(mac_key, header + encrypted, hashlib.sha256).digest()
+        return header + encrypted + tag
+
+    def unprotect(self, blob: bytes) -> bytearray:
+        header_size = len(self.VERSION) + self.NONCE_SIZE
+        if len(blob) < header_size + self.TAG_SIZE or blob[:1] != self.VERSION:
+            raise ValueError("Invalid encrypted data")
+
+        nonce = blob[1:header_size]
+        encrypted = blob[header_size:-self.TAG_SIZE]
+        enc_key, mac_key = self.derive_keys(nonce)
+        tag = hmac.new(mac_key, blob[:-self.TAG_SIZE], hashlib.sha256).digest()
+        if not hmac.compare_digest(tag, blob[-self.TAG_SIZE:]):
+            raise ValueError("Invalid encrypted data")
+
+        stream = self.keystream(enc_key, nonce, len(encrypted))
+        return bytearray(a ^ b for a, b in zip(encrypted, stream))
+
+
+CRYPT_BACKENDS: Dict[str, Type[CryptBackend]] = {
+    DpapiBackend.name: DpapiBackend,
+    PortableBackend.name: PortableBackend,
+}
+"""Known encryption backends
+"""
+
+
 class Crypt:
     """Class for working with encryption and decryption
     """
 
+    _backend: Optional[CryptBackend] = None
+
+    @staticmethod
+    def default_backend_name() -> str:
+        """Backend from CRYPT_BACKEND_ENV, or DPAPI on Windows
+
+        Returns:
+            str
+        """
+        name = os.environ.get(CRYPT_BACKEND_ENV)
+        if name:
+            return name
+        return DpapiBackend.name if sys.platform == 'win32' else PortableBackend.name
+
+    @staticmethod
+    def set_backend(backend: Optional[CryptBackend] = None, name: Optional[str] = None):
+        """Select encryption backend. Without arguments the default one is used again
+
+        Args:
+            backend (Optional[CryptBackend]): Backend instance
+            name (Optional[str]): Or name of a known backend
+        """
+        if backend is None and name is not None:
+            if name not in CRYPT_BACKENDS:
+                raise ValueError(f"Unknown crypt backend '{name}'")
+            backend = CRYPT_BACKENDS[name]()
+        Crypt._backend = backend
+
+    @staticmethod
+    def backend() -> CryptBackend:
+        """Current encryption backend, created on first use
+
+        Returns:
+            CryptBackend
+        """
+        if Crypt._backend is None:
+            Crypt.set_backend(name=Crypt.default_backend_name())
+        return Crypt._backend
+
     @staticmethod
     def encrypt_key(unencrypted: str) -> str:
         """Encrypt a string using the current user account
@@ -30,65 +314,241 @@ class Crypt:
         Returns:
             str: Encoded string
         """
-        # Convert the string to bytes
-        data = DATA_BLOB(len(unencrypted), ctypes.cast(ctypes.create_string_buffer(
-            unencrypted.encode('utf-8')), ctypes.POINTER(ctypes.c_ubyte)))
-        encrypted = DATA_BLOB()
+        timings.count('crypt_calls')
+        encrypted_bytes = Crypt.backend().protect(unencrypted.encode('utf-8'))
+        # Convert encrypted data to base64 for easy storage
+        return base64.b64encode(encrypted_bytes).decode('utf-8')
 
-        # Call the CryptProtectData function
-        if crypt32.CryptProtectData(ctypes.byref(data), None, None, None, None, 0, ctypes.byref(encrypted)):
-            # Convert encrypted data to base64 for easy storage
-            encrypted_bytes = ctypes.string_at(
-                encrypted.pbData, encrypted.cbData)
-            kernel32.LocalFree(encrypted.pbData)
-            return base64.b64encode(encrypted_bytes).decode('utf-8')
-        else:
-            raise ctypes.WinError()
+    @staticmethod
+    def blob(encrypted: Union[str, bytes]) -> bytes:
+        """Raw encrypted bytes of the key. Storage keeps them base64 encoded, entries in memory as bytes
+
+        Args:
+            encrypted (Union[str, bytes]): Base64 string or raw bytes
+
+        Returns:
+            bytes
+        """
+        return encrypted if isinstance(encrypted, bytes) else base64.b64decode(encrypted)
 
     @staticmethod
-    def decrypt_key(encrypted: str) -> str:
-        """Decrypt a string using the current user account
+    def decrypt_key_buffer(encrypted: Union[str, bytes]) -> bytearray:
+        """Decrypt a string using the current user account into a mutable buffer,
+        so the caller can wipe it later
 
         Args:
-            encrypted (str): Encrypted key string
+            encrypted (Union[str, bytes]): Encrypted key, see blob
 
         Returns:
-            str: Decoded string
+            bytearray: Decoded key bytes
         """
-        encrypted_data = base64.b64decode(encrypted)
-        data = DATA_BLOB(len(encrypted_data), ctypes.cast(
-            ctypes.create_string_buffer(encrypted_data), ctypes.POINTER(ctypes.c_ubyte)))
-        decrypted = DATA_BLOB()
+        timings.count('crypt_calls')
+        return Crypt.backend().unprotect(Crypt.blob(encrypted))
 
-        # Call the CryptUnprotectData function
-        if crypt32.CryptUnprotectData(ctypes.byref(data), None, None, None, None, 0, ctypes.byref(decrypted)):
-            decrypted_bytes = ctypes.string_at(
-                decrypted.pbData, decrypted.cbData)
-            kernel32.LocalFree(decrypted.pbData)
-            return decrypted_bytes.decode('utf-8')
-        else:
-            raise ctypes.WinError()
+    @staticmethod
+    def run_batch(handler: Callable[[list], list], items: list, workers: Optional[int] = None,
+                  min_size: int = CRYPT_PARALLEL_MIN, discard: Optional[Callable[[list], None]] = None) -> list:
+        """Run batch handler over items, split across a thread pool for big batches
+
+        Args:
+            handler (Callable[[list], list]): Processes a list, returns a list of the same length
+            items (list): Items
+            workers (Optional[int]): Threads count, CRYPT_WORKERS by default. 1 disables the pool
+            min_size (int): Smaller batches are processed in the current thread
+            discard (Optional[Callable[[list], None]]): Called with the results of finished chunks
+                if another chunk raises, before the error is raised again
+
+        Returns:
+            list: Results in the same order
+        """
+        if workers is None:
+            workers = CRYPT_WORKERS
+        if workers <= 1 or len(items) < min_size:
+            return handler(items)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        chunk_size = -(-len(items) // workers)
+        chunks = [items[i:i + chunk_size]
+                  for i in range(0, len(items), chunk_size)]
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            futures = [pool.submit(handler, chunk) for chunk in chunks]
+        # the pool is shut down, every chunk is finished
+        errors = [future.exception() for future in futures]
+        error = next((e for e in errors if e is not None), None)
+        if error is None:
+            return [item for future in futures for item in future.result()]
+        if discard is not None:
+            for future, chunk_error in zip(futures, errors):
+                if chunk_error is None:
+                    discard(future.result())
+        raise error
+
+    @staticmethod
+    def encrypt_many(unencrypted: List[str], workers: Optional[int] = None) -> List[str]:
+        """Encrypt list of strings using the current user account
+
+        Args:
+            unencrypted (List[str]): Unencrypted key strings
+            workers (Optional[int]): Threads count, see run_batch
+
+        Returns:
+            List[str]: Encoded strings in the same order
+        """
+        timings.count('crypt_calls', len(unencrypted))
+        encrypted = Crypt.run_batch(
+            Crypt.backend().protect_many,
+            [key.encode('utf-8') for key in unencrypted],
+            workers=workers
+        )
+        return [base64.b64encode(blob).decode('utf-8') for blob in encrypted]
 
     @staticmethod
-    def ecrypt_data(link: str) -> Tuple[str, str]:
-        """Encrypt data
+    def decrypt_many(encrypted: List[Union[str, bytes]], workers: Optional[int] = None) -> List[bytearray]:
+        """Decrypt list of strings using the current user account into mutable buffers
+
+        Args:
+            encrypted (List[Union[str, bytes]]): Encrypted keys, see blob
+            workers (Optional[int]): Threads count, see run_batch
+
+        Returns:
+            List[bytearray]: Decoded key bytes in the same order
+        """
+        timings.count('crypt_calls', len(encrypted))
+        return Crypt.run_batch(
+            Crypt.backend().unprotect_many,
+            [Crypt.blob(key) for key in encrypted],
+            workers=workers,
+            discard=Crypt.wipe_buffers
+        )
+
+    @staticmethod
+    def wipe_buffers(buffers: List[bytearray]):
+        """Overwrite decrypted buffers with zeros in place, like SecretCache.wipe
+
+        Args:
+            buffers (List[bytearray])
+        """
+        for buffer in buffers:
+            buffer[:] = bytes(len(buffer))
+
+    @staticmethod
+    def secret_fingerprint(secret: Union[str, bytes, bytearray], salt: str, type: str = 'totp',
+                           algorithm: str = 'SHA1', digits: int = 6, period: int = 30) -> str:
+        """Keyed hash of secret key and code options, the same for any case, padding and spaces of base32 secret.
+        Accounts with the same secret but other code options get other fingerprints
+
+        Args:
+            secret (Union[str, bytes, bytearray]): Unencrypted base32 key
+            salt (str): Hex key, OtpConfig.salt
+            type (str): 'totp' or 'hotp'
+            algorithm (str): HMAC algorithm
+            digits (int): Code length
+            period (int): Time step in seconds
+
+        Returns:
+            str: Hex fingerprint
+        """
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        normalized = Crypt.normalize_secret(secret)
+        try:
+            mac = hmac.new(bytes.fromhex(salt), normalized, hashlib.sha256)
+        finally:
+            normalized[:] = bytes(len(normalized))
+        mac.update(f"|{type}|{algorithm.upper()}|{digits}|{period}".encode('ascii'))
+        return mac.hexdigest()[:32]
+
+    @staticmethod
+    def normalize_secret(secret: Union[bytes, bytearray]) -> bytearray:
+        """Base32 secret in upper case, without spaces and padding. Fingerprints and code generators
+        normalize secrets the same way, so a secret which is fingerprinted can be decoded too
+
+        Args:
+            secret (Union[bytes, bytearray]): Base32 secret
+
+        Returns:
+            bytearray: New buffer, the caller wipes it
+        """
+        # a bytearray is translated into a new bytearray, without an immutable copy
+        normalized = secret.translate(BASE32_UPPER, b' =')
+        return normalized if isinstance(normalized, bytearray) else bytearray(normalized)
+
+    @staticmethod
+    def parse_link(link: str) -> Tuple[str, str, dict]:
+        """Get secret, name and code options from otpauth link
 
         Args:
             link (str): otpauth:// link
 
         Returns:
-            Tuple[str, str]: (enc_key, f"{issuer}:{second_name}")
+            Tuple[str, str, dict]: (key, f"{issuer}:{second_name}", options). Options are Entrie fields: type, algorithm, digits, period, counter
+        """
+        # imported on first import of a link only, it's not needed to answer queries
+        import pyotp
+
+        otp = pyotp.parse_uri(link)
+        issuer = otp.issuer
+        name = otp.name
+        key = otp.secret
+
+        if not issuer:
+            issuer = "<NO NAME>"
+        if not name:
+            name = "<NO NAME>"
+
+        options = {
+            "algorithm": otp.digest().name.upper(),
+            "digits": otp.digits,
+        }
+        if isinstance(otp, pyotp.HOTP):
+            options.update(type='hotp', counter=otp.initial_count)
+        else:
+            options.update(type='totp', period=otp.interval)
+
+        return key, f"{issuer}:{name}", options
+
+    @staticmethod
+    def parse_account(account) -> Tuple[str, str, dict]:
+        """Get secret, name and code options from decoded migration account, like parse_link does from otpauth link
+
+        Args:
+            account (migration_decoder.decoder.OtpAccount): Decoded account
+
+        Returns:
+            Tuple[str, str, dict]: (key, f"{issuer}:{second_name}", options)
         """
-        totp = pyotp.parse_uri(link)
-        issuer = totp.issuer
-        name = totp.name
-        key = totp.secret
+        issuer = account.issuer
+        name = account.name
+        if ':' in name:
+            label_issuer, name = name.split(':', 1)
+            issuer = issuer or label_issuer
 
         if not issuer:
             issuer = "<NO NAME>"
         if not name:
             name = "<NO NAME>"
 
-        # we need encrypt key and save it!
-        enc_key = Crypt.encrypt_key(key)
-        return enc_key, f"{issuer}:{name}"
+        options = {
+            "type": account.type,
+            "algorithm": account.algorithm,
+            "digits": account.digits,
+        }
+        if account.type == 'hotp':
+            options.update(counter=account.counter)
+
+        return account.secret, f"{issuer}:{name}", options
+
+    @staticmethod
+    def encrypt_accounts(accounts: List[Tuple[str, str, dict]], workers: Optional[int] = None) -> List[Tuple[str, str, dict]]:
+        """Encrypt keys of parsed accounts in one batch
+
+        Args:
+            accounts (List[Tuple[str, str, dict]]): [(key, name, options), ...], see parse_link
+            workers (Optional[int]): Threads count, see run_batch
+
+        Returns:
+            List[Tuple[str, str, dict]]: [(enc_key, name, options), ...]
+        """
+        enc_keys = Crypt.encrypt_many([key for key, _, _ in accounts], workers=workers)
+        return [(enc_key, name, options) for enc_key, (_, name, options) in zip(enc_keys, accounts)]
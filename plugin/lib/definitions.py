@@ -1,3 +1,6 @@
+import os
+import hashlib
+
 from plugin.lib.models import OtpConfig
 
 APP_ICON = "Images/app.png"
@@ -7,13 +10,143 @@ OTP_CONFIG_PATH = "OTPList.json"
 """Migrations list
 """
 
-OTP_CONFIG_DEFAULT_DATA = OtpConfig(version=1)
+OTP_BINARY_PATH = "OTPList.bin"
+"""Otp config in binary format, used instead of OTPList.json when binary storage setting is on
+"""
+
+OTP_BINARY_VERSION = 2
+"""Version of binary storage format, OTPList.json is version 1
+"""
+
+OTP_JOURNAL_PATH = "OTPList.journal"
+"""Append-only journal of OTPList.json changes
+"""
+
+OTP_LOCK_PATH = "OTPList.lock"
+"""Lock file of the storage, shared by plugin processes. Keeps the storage generation
+"""
+
+FILE_LOCK_TIMEOUT = 10
+"""Seconds to wait for the storage lock of another process
+"""
+
+OTP_JOURNAL_COMPACT_SIZE = 64 * 1024
+"""Journal size in bytes which triggers its merge into OTPList.json
+"""
+
+OTP_CONFIG_VERSION = 2
+"""Version of otp config data. Since version 2 entry fingerprints cover code options too,
+fingerprints of older configs are generated again on the next import
+"""
+
+OTP_CONFIG_DEFAULT_DATA = OtpConfig(version=OTP_CONFIG_VERSION)
 """Default empty config data
 """
 
+OTP_ALGORITHMS = {
+    'SHA1': hashlib.sha1,
+    'SHA256': hashlib.sha256,
+    'SHA512': hashlib.sha512,
+    'MD5': hashlib.md5,
+}
+"""HMAC algorithms of entries
+"""
+
 OTP_SCHEME_TO_TYPE = {
     'otpauth-migration': 'google',
     'otpauth': 'default',
 }
 """Opt schemes
 """
+
+SECRET_CACHE_TTL = 300
+"""Seconds a decrypted key may stay unused in memory
+"""
+
+SECRET_CACHE_SIZE = 1024
+"""Max count of decrypted keys in memory
+"""
+
+CRYPT_BACKEND_ENV = "TOTP_CRYPT_BACKEND"
+"""Environment variable to select encryption backend: "dpapi" or "portable"
+"""
+
+PORTABLE_KEY_ENV = "TOTP_PORTABLE_KEY"
+"""Environment variable with master key passphrase for the portable backend
+"""
+
+PORTABLE_KEY_PATH = "OTPList.key"
+"""Master key file of the portable backend, used if PORTABLE_KEY_ENV is not set
+"""
+
+PORTABLE_KEY_ITERATIONS = 1000
+"""PBKDF2 iterations per encrypted key of the portable backend
+"""
+
+CRYPT_WORKERS = min(8, os.cpu_count() or 1)
+"""Threads for batch encryption/decryption, native calls release the GIL
+"""
+
+CRYPT_PARALLEL_MIN = 32
+"""Batches smaller than this are processed in the calling thread
+"""
+
+WATCH_INTERVAL = 0.5
+"""Seconds between polls of storage files in the resident process
+"""
+
+USAGE_PATH = "OTPUsage.bin"
+"""Usage counters sidecar of OTPList.json
+"""
+
+USAGE_HALF_LIFE = 7 * 24 * 60 * 60
+"""Seconds after which one copy counts half for the ranking
+"""
+
+USAGE_MAX_RECORDS = 4096
+"""Usage records count which triggers compaction of the sidecar
+"""
+
+TOP_RESULTS_COUNT = 0
+"""Results count for empty query, most used entries first. 0 shows all entries
+"""
+
+IMPORT_PARALLEL_MIN = 4
+"""Min count of settings links which are decoded and parsed in a thread pool
+"""
+
+MAX_RESULTS = 100
+"""Max count of results of any query, 0 for all
+"""
+
+IMPORT_CHUNK_SIZE = 256
+"""Accounts encrypted and added per batch while importing
+"""
+
+TIMINGS_LOG_PATH = "OTPTimings.log"
+"""Log of query timings, written when debug timings setting is on
+"""
+
+TIMINGS_LOG_SIZE = 256 * 1024
+"""Max size of timings log before rotation
+"""
+
+TIMINGS_LOG_BACKUPS = 2
+"""Count of rotated timings logs
+"""
+
+PRECOMPUTE_LEAD = 1.0
+"""Seconds before the time step boundary when codes of the next step are computed
+"""
+
+NEXT_CODE_SECONDS = 5
+"""Next code is shown for entries which expire in this count of seconds or less
+"""
+
+VERIFY_PREFIX = "?"
+"""Query prefix of the code verification mode, ex: "?123456"
+"""
+
+VERIFY_WINDOW = 1
+"""Time steps (or HOTP counters) around the current one where a verified code is accepted
+"""
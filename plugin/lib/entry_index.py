@@ -0,0 +1,69 @@
+# libs
+from plugin.lib.models import Entrie
+
+# types
+from typing import Dict, Iterable, List, Optional
+
+
+class EntryIndex:
+    """Index of vault entries by name and by keyed secret fingerprint, maintained alongside OtpConfig.entries
+    """
+
+    def __init__(self, entries: Iterable[Entrie] = ()):
+        """
+        Args:
+            entries (Iterable[Entrie]): Entries, later entry with the same name replaces the earlier one
+        """
+        self.by_name: Dict[str, Entrie] = {}
+        self.fingerprints: Dict[str, int] = {}
+        """Fingerprint -> count of indexed names with it
+        """
+        self._fingerprint_of: Dict[str, str] = {}
+        """Name -> fingerprint the entry is indexed by, the entry's own fingerprint may be changed since
+        """
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry: Entrie):
+        """Index the entry, replaces indexed entry with the same name and drops its fingerprint
+
+        Args:
+            entry (Entrie)
+        """
+        previous = self._fingerprint_of.pop(entry.name, None)
+        if previous is not None:
+            if self.fingerprints[previous] > 1:
+                self.fingerprints[previous] -= 1
+            else:
+                del self.fingerprints[previous]
+        self.by_name[entry.name] = entry
+        if entry.fingerprint:
+            self.fingerprints[entry.fingerprint] = self.fingerprints.get(entry.fingerprint, 0) + 1
+            self._fingerprint_of[entry.name] = entry.fingerprint
+
+    def contains(self, name: Optional[str] = None, fingerprint: Optional[str] = None) -> bool:
+        """Check if an entry with the name or with the same secret and code options exists
+
+        Args:
+            name (Optional[str]): Name of key
+            fingerprint (Optional[str]): Keyed hash of secret key and code options, see Crypt.secret_fingerprint
+
+        Returns:
+            bool
+        """
+        return (name is not None and name in self.by_name) \
+            or (bool(fingerprint) and fingerprint in self.fingerprints)
+
+    def get(self, name: str) -> Optional[Entrie]:
+        return self.by_name.get(name)
+
+    def entries(self) -> List[Entrie]:
+        """Unique entries in first seen order
+
+        Returns:
+            List[Entrie]
+        """
+        return list(self.by_name.values())
+
+    def __len__(self):
+        return len(self.by_name)
@@ -1,36 +1,325 @@
+import os
+import copy
 import json
+import threading
 
 # lib
-from plugin.lib.definitions import OTP_CONFIG_PATH, OTP_CONFIG_DEFAULT_DATA
+from plugin.lib.definitions import (
+    OTP_CONFIG_PATH,
+    OTP_CONFIG_DEFAULT_DATA,
+    OTP_BINARY_PATH,
+    OTP_JOURNAL_PATH,
+    OTP_JOURNAL_COMPACT_SIZE,
+)
 from plugin.lib.models import OtpConfig
+from plugin.lib.binary_vault import BinaryVault
+from plugin.lib.locks import FileLock
+from plugin.lib.instrument import timings
+
+# types
+from typing import Callable, List, Optional
+
+JOURNAL_COMPACTING_PATH = f"{OTP_JOURNAL_PATH}.compacting"
+"""Journal which is being merged into OTPList.json by compaction
+"""
 
 
 class Files:
+    lock = FileLock()
+    """Storage lock between plugin processes: shared for reads, exclusive for writes
+    """
+    _compaction: Optional[threading.Thread] = None
+    binary = False
+    """Otp config is stored in OTPList.bin instead of OTPList.json
+    """
+
+    @staticmethod
+    def set_binary(enabled: bool):
+        """Select otp config format
+
+        Args:
+            enabled (bool): Binary OTPList.bin or json OTPList.json
+        """
+        Files.binary = enabled
+
+    @staticmethod
+    def config_path() -> str:
+        """Otp config file of the selected format
+        """
+        return OTP_BINARY_PATH if Files.binary else OTP_CONFIG_PATH
+
     @staticmethod
-    def read_otp_config() -> dict:
-        """Read OTPList.json
+    def read_config_file(path: str, raw_keys: bool = False) -> dict:
+        """Read otp config file of any format, without the journal
+
+        Args:
+            path (str): Config file
+            raw_keys (bool): Binary vault keys are returned as raw bytes, see BinaryVault.read
 
         Returns:
             dict: Migration config
         """
-        with open(OTP_CONFIG_PATH, "r") as f:
+        if BinaryVault.is_binary(path):
+            return BinaryVault.read(path, raw_keys=raw_keys)
+        with open(path, "r") as f:
             return json.load(f)
 
+    @staticmethod
+    def write_config(data: dict, path: Optional[str] = None):
+        """Atomically write otp config in the format of the file, under the exclusive storage lock
+
+        Args:
+            data (dict): Raw config data
+            path (Optional[str]): Config file, config_path() by default
+        """
+        path = path or Files.config_path()
+        with Files.lock.hold(exclusive=True):
+            if path == OTP_BINARY_PATH:
+                BinaryVault.write_atomic(path, data)
+            else:
+                Files.write_atomic(path, data)
+            Files.lock.bump()
+
+    @staticmethod
+    def generation() -> int:
+        """Storage generation, incremented by every write of any plugin process
+
+        Returns:
+            int
+        """
+        with Files.lock.hold():
+            return Files.lock.generation()
+
+    @staticmethod
+    def migrate_storage():
+        """Convert otp config into the selected format, if only the other format file exists.
+        The old file is kept as a .bak copy
+        """
+        target = Files.config_path()
+        source = OTP_CONFIG_PATH if Files.binary else OTP_BINARY_PATH
+        if os.path.exists(target) or not os.path.exists(source):
+            return
+
+        with Files.lock.hold(exclusive=True):
+            # another process could migrate it while we waited
+            if os.path.exists(target) or not os.path.exists(source):
+                return
+            Files.write_config(Files.read_config_file(source), path=target)
+            os.replace(source, f"{source}.bak")
+
+    @staticmethod
+    def read_otp_config(raw_keys: bool = False) -> dict:
+        """Read otp config, plus changes from the journal if it exists
+
+        Args:
+            raw_keys (bool): Binary vault keys are returned as raw bytes, see BinaryVault.read
+
+        Returns:
+            dict: Migration config
+        """
+        with timings.phase('config_read'), Files.lock.hold():
+            data = Files.read_config_file(Files.config_path(), raw_keys=raw_keys)
+
+            for path in (JOURNAL_COMPACTING_PATH, OTP_JOURNAL_PATH):
+                Files.replay_journal(data=data, path=path)
+        return data
+
+    @staticmethod
+    def find_entry(name: str) -> Optional[dict]:
+        """Find the entry by exact name. The binary vault without journal changes is searched
+        in place, without reading other entries, otherwise the whole config is read
+
+        Args:
+            name (str): Entry name
+
+        Raises:
+            FileNotFoundError: If the otp config doesn't exist
+
+        Returns:
+            Optional[dict]: Entrie fields with the raw encrypted key, None if not found
+        """
+        with Files.lock.hold():
+            journals = any(os.path.exists(path) for path in (JOURNAL_COMPACTING_PATH, OTP_JOURNAL_PATH))
+            if Files.binary and not journals:
+                return BinaryVault.find(OTP_BINARY_PATH, name, raw_keys=True)
+            entries = Files.read_otp_config(raw_keys=True)['entries']
+        # the later entry with the same name wins, like on load
+        return next((entry for entry in reversed(entries) if entry['name'] == name), None)
+
+    @staticmethod
+    def write_atomic(path: str, data: dict):
+        """Write json into temp file and replace the target with it, so an
+        interrupted write never leaves a truncated file
+        """
+        timings.count('disk_writes')
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
     @staticmethod
     def save_storage(data: OtpConfig):
-        """Save current opt config data into otr config json
+        """Save current opt config data into otp config file. Journal is merged, so it is removed
+        """
+        Files.save_raw_storage(data=data.to_dict())
+
+    @staticmethod
+    def save_raw_storage(data: dict):
+        """Save raw config data into otp config file, see save_storage
+
+        Args:
+            data (dict): Raw config data
         """
-        with open(OTP_CONFIG_PATH, "w") as f:
-            json.dump(data.to_dict(), f, indent=4)
+        with Files.lock.hold(exclusive=True):
+            Files.write_config(data)
+            for path in (JOURNAL_COMPACTING_PATH, OTP_JOURNAL_PATH):
+                if os.path.exists(path):
+                    os.remove(path)
 
     @staticmethod
     def load_empty_storage_data():
-        """If otp config file NOT found, return default OptConfig dataclass
+        """If otp config file NOT found, write and return default OptConfig dataclass
+
+        Returns:
+            Optional[OtpConfig]: None if another process has created the file meanwhile
+        """
+        # copy, so entries added later never leak into the default data
+        data = copy.deepcopy(OTP_CONFIG_DEFAULT_DATA)
+        data.salt = Files.new_salt()
+        with Files.lock.hold(exclusive=True):
+            # another process could create it while we waited
+            if os.path.exists(Files.config_path()):
+                return None
+            Files.write_config(data.to_dict())
+        return data
+
+    @staticmethod
+    def new_salt() -> str:
+        """Random key of secret fingerprints
+
+        Returns:
+            str: Hex key
+        """
+        return os.urandom(16).hex()
+
+    @staticmethod
+    def append_journal(records: List[dict]) -> int:
+        """Append changes to the journal instead of rewriting OTPList.json
+
+        Args:
+            records (List[dict]): Journal records, see replay_journal
 
         Returns:
-            OtpConfig
+            int: Journal size in bytes
         """
-        with open(OTP_CONFIG_PATH, "w") as new_config:
-            json.dump(OTP_CONFIG_DEFAULT_DATA.to_dict(),
-                      new_config, indent=4)
-            return OTP_CONFIG_DEFAULT_DATA
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        timings.count('disk_writes')
+        with Files.lock.hold(exclusive=True):
+            with open(OTP_JOURNAL_PATH, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            Files.lock.bump()
+            return size
+
+    @staticmethod
+    def replay_journal(data: dict, path: str = OTP_JOURNAL_PATH):
+        """Apply journal records to raw config data. Replay is idempotent, so a journal
+        which was already merged by an interrupted compaction does no harm
+
+        Records:
+            {"op": "add", "entry": {...}}: new entry, skipped if the name exists
+            {"op": "imported", "fingerprints": [...]}: import ledger fingerprints
+            {"op": "counter", "name": "...", "counter": 1}: HOTP counter
+
+        Args:
+            data (dict): Raw config data
+            path (str): Journal file
+        """
+        try:
+            with open(path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # torn last line of an interrupted append
+                continue
+        Files.apply_records(data=data, records=records)
+
+    @staticmethod
+    def apply_records(data: dict, records: List[dict]):
+        """Apply journal records to raw config data, see replay_journal
+
+        Args:
+            data (dict): Raw config data
+            records (List[dict]): Journal records
+        """
+        entries = data.setdefault('entries', [])
+        names = {entry['name']: entry for entry in entries}
+        imported = data.setdefault('imported', [])
+        known_fingerprints = set(imported)
+        for record in records:
+            op = record.get('op')
+            if op == 'add':
+                entry = record['entry']
+                if entry['name'] not in names:
+                    entries.append(entry)
+                    names[entry['name']] = entry
+            elif op == 'imported':
+                for fingerprint in record['fingerprints']:
+                    if fingerprint not in known_fingerprints:
+                        known_fingerprints.add(fingerprint)
+                        imported.append(fingerprint)
+            elif op == 'counter':
+                entry = names.get(record['name'])
+                if entry is not None:
+                    entry['counter'] = record['counter']
+
+    @staticmethod
+    def need_compaction(journal_size: int) -> bool:
+        return journal_size >= OTP_JOURNAL_COMPACT_SIZE
+
+    @staticmethod
+    def compact_journal(on_done: Optional[Callable[[int], None]] = None) -> threading.Thread:
+        """Merge the journal into the otp config file in a background thread. The merge reads
+        the storage under the exclusive lock, so changes of other plugin processes are kept
+
+        Args:
+            on_done (Optional[Callable[[int], None]]): Called with the storage generation before the merge
+                was written, still under the exclusive lock. Not called if the compaction is already running
+
+        Returns:
+            threading.Thread: Started compaction thread, or the running one
+        """
+        if Files._compaction is not None and Files._compaction.is_alive():
+            return Files._compaction
+
+        with Files.lock.hold(exclusive=True):
+            config_path = Files.config_path()
+            # changes appended from now on go to a new journal. A journal left by an
+            # interrupted compaction is merged first, the current one waits for the next time
+            if os.path.exists(OTP_JOURNAL_PATH) and not os.path.exists(JOURNAL_COMPACTING_PATH):
+                os.replace(OTP_JOURNAL_PATH, JOURNAL_COMPACTING_PATH)
+
+        def compact():
+            with Files.lock.hold(exclusive=True):
+                generation = Files.lock.generation()
+                data = Files.read_config_file(config_path)
+                Files.replay_journal(data=data, path=JOURNAL_COMPACTING_PATH)
+                Files.write_config(data, path=config_path)
+                if os.path.exists(JOURNAL_COMPACTING_PATH):
+                    os.remove(JOURNAL_COMPACTING_PATH)
+                if on_done is not None:
+                    on_done(generation)
+
+        Files._compaction = threading.Thread(target=compact, name="journal-compaction")
+        Files._compaction.start()
+        return Files._compaction
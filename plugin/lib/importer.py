@@ -0,0 +1,182 @@
+from urllib.parse import urlparse
+
+# libs
+from plugin.lib.crypt import Crypt
+from plugin.lib.codes import OtpGenerator
+from plugin.lib.secret_cache import SecretCache
+from plugin.lib.models import ImportReport, LinkError, UrlScheme
+from plugin.lib.definitions import OTP_SCHEME_TO_TYPE, IMPORT_PARALLEL_MIN
+
+# types
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+Account = Tuple[str, str, dict]
+"""(key, name, options), see Crypt.parse_link
+"""
+
+DecodedLink = Tuple[UrlScheme, Optional[List[Account]], Optional[LinkError]]
+"""(link, parsed accounts, error). Accounts of migration links are None, their payloads
+are decoded one by one while accounts are assembled
+"""
+
+
+class Importer:
+    """Stages of settings links import:
+
+        classify -> check (migration links) / parse (otpauth links) -> assemble accounts
+
+    Checking and parsing of independent links runs in a thread pool. Migration payloads
+    are decoded only while accounts are assembled, so a big export is streamed. A failed link
+    is recorded in ImportReport, the other links are imported anyway.
+    Encryption and the storage commit are done by Totp.handle_auth_import
+    """
+
+    @staticmethod
+    def safe_link(url: str) -> str:
+        """Link without query parameters, which contain the secret
+
+        Returns:
+            str: Ex: "otpauth://totp/Issuer:name"
+        """
+        return url.split('?', 1)[0]
+
+    @staticmethod
+    def classify(urls: List[str], report: ImportReport, lines: Dict[str, int]) -> List[UrlScheme]:
+        """Detect the link type by its scheme
+
+        Args:
+            urls (List[str]): Links
+            report (ImportReport): Collects unsupported links
+            lines (Dict[str, int]): Link -> line in settings, for the report
+
+        Returns:
+            List[UrlScheme]: Supported links
+        """
+        result = []
+        for url in urls:
+            t = OTP_SCHEME_TO_TYPE.get(urlparse(url).scheme)
+            if t:
+                result.append(UrlScheme(type=t, url=url))
+            else:
+                # unknown text may be a bare secret, only its scheme is reported
+                scheme = urlparse(url).scheme
+                report.errors.append(LinkError(
+                    line=lines.get(url, 0), stage='classify', link=f"{scheme}://..." if scheme else "...",
+                    message="Unsupported link, expected otpauth:// or otpauth-migration://"))
+        return result
+
+    @staticmethod
+    def decode_link(obj: UrlScheme) -> DecodedLink:
+        """Check migration link format or parse otpauth link
+
+        Args:
+            obj (UrlScheme): Link
+
+        Returns:
+            DecodedLink: (link, None or [account], None) or (link, None, error)
+        """
+        stage = 'decode' if obj.type == 'google' else 'parse'
+        try:
+            if obj.type == 'google':
+                # protobuf is loaded only when there are migration links
+                from plugin.migration_decoder.decoder import validate_migration
+
+                validate_migration(obj.url)
+                return obj, None, None
+
+            account = Crypt.parse_link(obj.url)
+            SecretCache.wipe(OtpGenerator.decode_secret(bytearray(account[0].encode('utf-8'))))
+            return obj, [account], None
+        except Exception as e:
+            return obj, None, LinkError(
+                line=0, stage=stage, link=Importer.safe_link(obj.url), message=str(e) or e.__class__.__name__)
+
+    @staticmethod
+    def decode_many(urls: List[UrlScheme], workers: Optional[int] = None) -> List[DecodedLink]:
+        """Check and parse independent links concurrently
+
+        Args:
+            urls (List[UrlScheme]): Links
+            workers (Optional[int]): Threads count, see Crypt.run_batch
+
+        Returns:
+            List[DecodedLink]: In the same order
+        """
+        return Crypt.run_batch(
+            lambda chunk: [Importer.decode_link(obj) for obj in chunk],
+            urls,
+            workers=workers,
+            min_size=IMPORT_PARALLEL_MIN
+        )
+
+    @staticmethod
+    def accounts(decoded: List[DecodedLink], report: ImportReport, lines: Dict[str, int],
+                 skipped: Iterable[str] = ()) -> Iterator[Account]:
+        """Stream accounts of decoded links in their order. Migration payloads are decoded one by one,
+        parts of a multi QR export are reassembled across all links. If a migration link fails midway,
+        its accounts yielded before the error are imported
+
+        Args:
+            decoded (List[DecodedLink]): Results of decode_many
+            report (ImportReport): Collects failed links and missing export parts
+            lines (Dict[str, int]): Link -> line in settings, for the report
+            skipped (Iterable[str]): Links skipped by the import ledger, see missing_parts
+
+        Returns:
+            Iterator[Account]: Accounts of all links
+        """
+        assembler = None
+        for obj, items, error in decoded:
+            if error is not None:
+                error.line = lines.get(obj.url, 0)
+                report.errors.append(error)
+                continue
+            if obj.type != 'google':
+                yield from items
+                continue
+
+            from plugin.migration_decoder.decoder import BatchAssembler, get_account, iter_payloads
+
+            if assembler is None:
+                assembler = BatchAssembler()
+            try:
+                for payload in iter_payloads(obj.url):
+                    if not assembler.add(payload):
+                        continue
+                    for otp_item in payload.otp_parameters:
+                        yield Crypt.parse_account(get_account(otp_item))
+            except Exception as e:
+                report.errors.append(LinkError(
+                    line=lines.get(obj.url, 0), stage='decode', link=Importer.safe_link(obj.url),
+                    message=str(e) or e.__class__.__name__))
+
+        if assembler is not None:
+            report.missing_parts = Importer.missing_parts(assembler, skipped)
+
+    @staticmethod
+    def missing_parts(assembler, skipped: Iterable[str]) -> int:
+        """Count missing parts of multi QR exports. Parts imported by an earlier load are skipped
+        by the ledger, so the skipped migration links are read only if some parts look missing
+
+        Args:
+            assembler (BatchAssembler): Parts of this import
+            skipped (Iterable[str]): Links skipped by the import ledger
+
+        Returns:
+            int
+        """
+        from plugin.migration_decoder.decoder import iter_payloads
+
+        missing = assembler.missing()
+        if missing:
+            for url in skipped:
+                if OTP_SCHEME_TO_TYPE.get(urlparse(url).scheme) != 'google':
+                    continue
+                try:
+                    for payload in iter_payloads(url):
+                        if payload.batch_id in missing:
+                            assembler.add(payload)
+                except Exception:
+                    continue
+            missing = assembler.missing()
+        return sum(len(parts) for parts in missing.values())
@@ -0,0 +1,113 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# libs
+from plugin.lib.definitions import TIMINGS_LOG_PATH, TIMINGS_LOG_SIZE, TIMINGS_LOG_BACKUPS
+
+# types
+from typing import Dict, Optional
+
+
+class Timings:
+    """Opt-in per query instrumentation: phase durations and counters of expensive calls.
+    Does nothing until start(enabled=True)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self._started = 0.0
+        self._lock = threading.Lock()
+        self._logger = None
+
+    def start(self, enabled: bool, started: Optional[float] = None):
+        """Begin measuring one request
+
+        Args:
+            enabled (bool): Measure it or not
+            started (Optional[float]): time.perf_counter() of the request start, now by default
+        """
+        self.enabled = enabled
+        self.phases = {}
+        self.counters = {}
+        self._started = time.perf_counter() if started is None else started
+
+    def add(self, name: str, started: float):
+        """Record phase which started before start() was called
+
+        Args:
+            name (str): Phase name
+            started (float): time.perf_counter() of the phase start
+        """
+        if self.enabled:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measure duration of the block, repeated phases are summed up
+
+        Args:
+            name (str): Phase name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name: str, value: int = 1):
+        """Count expensive calls, like DPAPI calls or disk writes
+
+        Args:
+            name (str): Counter name
+            value (int): Increment
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def total(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def summary(self) -> str:
+        """One line report
+
+        Returns:
+            str: Ex: "total 1.20ms | load 0.10ms, codes 0.50ms | crypt_calls 3"
+        """
+        phases = ", ".join(f"{name} {ms:.2f}ms" for name, ms in self.phases.items())
+        counters = ", ".join(f"{name} {value}" for name, value in self.counters.items())
+        return " | ".join(part for part in (f"total {self.total():.2f}ms", phases, counters) if part)
+
+    def log(self, message: str):
+        """Write the report into rotating local log
+
+        Args:
+            message (str): Log line, ex: request description with summary()
+        """
+        if self._logger is None:
+            import logging
+            from logging.handlers import RotatingFileHandler
+
+            self._logger = logging.getLogger("totp.timings")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            handler = RotatingFileHandler(
+                TIMINGS_LOG_PATH, maxBytes=TIMINGS_LOG_SIZE, backupCount=TIMINGS_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._logger.addHandler(handler)
+        self._logger.info(message)
+
+
+timings = Timings()
+"""Instrumentation of the current request
+"""
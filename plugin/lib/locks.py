@@ -0,0 +1,187 @@
+import os
+import sys
+import errno
+import time
+import ctypes
+import struct
+import threading
+from contextlib import contextmanager
+
+# libs
+from plugin.lib.definitions import OTP_LOCK_PATH, FILE_LOCK_TIMEOUT
+
+# types
+from typing import Iterator
+
+GENERATION = struct.Struct("<Q")
+"""Storage generation counter at the start of the lock file
+"""
+
+LOCK_OFFSET = 1 << 31
+"""Locked byte of the lock file, far after the counter so locks never block its reads and writes
+"""
+
+GATE_OFFSET = LOCK_OFFSET + 1
+"""Byte taken before the lock: a waiting writer holds it exclusively, so new readers wait
+behind it and a stream of readers can't starve writers
+"""
+
+LOCK_POLL = 0.005
+"""Seconds between attempts to take a busy lock
+"""
+
+
+class OVERLAPPED(ctypes.Structure):
+    _fields_ = [
+        ('Internal', ctypes.c_void_p),
+        ('InternalHigh', ctypes.c_void_p),
+        ('Offset', ctypes.c_ulong),
+        ('OffsetHigh', ctypes.c_ulong),
+        ('hEvent', ctypes.c_void_p)
+    ]
+
+
+class FileLock:
+    """Advisory lock between plugin processes, shared for readers and exclusive for writers
+    (byte range locks: fcntl.lockf, LockFileEx on Windows). The lock file also keeps the storage
+    generation, which every write increments. Re-entrant in one process: a nested lock reuses the held one
+    """
+
+    LOCKFILE_FAIL_IMMEDIATELY = 0x1
+    LOCKFILE_EXCLUSIVE_LOCK = 0x2
+
+    def __init__(self, path: str = OTP_LOCK_PATH, timeout: float = FILE_LOCK_TIMEOUT):
+        """
+        Args:
+            path (str): Lock file, it's never replaced or removed
+            timeout (float): Seconds to wait for the lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self._fd = None
+        self._depth = 0
+        self._exclusive = False
+        self._thread_lock = threading.RLock()
+        self._kernel32 = None
+
+    def try_lock(self, offset: int, exclusive: bool) -> bool:
+        """Lock one byte without waiting
+
+        Args:
+            offset (int): LOCK_OFFSET or GATE_OFFSET
+            exclusive (bool): Exclusive or shared lock
+
+        Returns:
+            bool: False if the byte is locked by another process
+        """
+        if sys.platform == 'win32':
+            import msvcrt
+
+            if self._kernel32 is None:
+                self._kernel32 = ctypes.WinDLL('kernel32.dll', use_last_error=True)
+            flags = self.LOCKFILE_FAIL_IMMEDIATELY | (self.LOCKFILE_EXCLUSIVE_LOCK if exclusive else 0)
+            overlapped = OVERLAPPED(Offset=offset)
+            return bool(self._kernel32.LockFileEx(
+                ctypes.c_void_p(msvcrt.get_osfhandle(self._fd)), flags, 0, 1, 0, ctypes.byref(overlapped)))
+
+        import fcntl
+
+        try:
+            fcntl.lockf(self._fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB, 1, offset)
+            return True
+        except OSError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+
+    def unlock(self, offset: int):
+        if sys.platform == 'win32':
+            import msvcrt
+
+            overlapped = OVERLAPPED(Offset=offset)
+            self._kernel32.UnlockFileEx(
+                ctypes.c_void_p(msvcrt.get_osfhandle(self._fd)), 0, 1, 0, ctypes.byref(overlapped))
+            return
+
+        import fcntl
+
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def acquire(self, exclusive: bool):
+        """Open the lock file and wait for the lock. The gate byte is held while waiting,
+        exclusively by writers, and released once the lock is taken
+
+        Raises:
+            TimeoutError: If the lock is not taken in timeout
+        """
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o600)
+        deadline = time.monotonic() + self.timeout
+        gate = False
+        try:
+            while True:
+                gate = gate or self.try_lock(GATE_OFFSET, exclusive)
+                if gate and self.try_lock(LOCK_OFFSET, exclusive):
+                    break
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"{self.path} is locked by another process")
+                time.sleep(LOCK_POLL)
+        except BaseException:
+            if gate:
+                self.unlock(GATE_OFFSET)
+            os.close(self._fd)
+            self._fd = None
+            raise
+        self.unlock(GATE_OFFSET)
+        self._exclusive = exclusive
+
+    def release(self):
+        try:
+            self.unlock(LOCK_OFFSET)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def hold(self, exclusive: bool = False) -> Iterator['FileLock']:
+        """Hold the lock for the block
+
+        Args:
+            exclusive (bool): Exclusive lock for writers, shared for readers
+
+        Raises:
+            TimeoutError: If the lock is not taken in timeout
+            RuntimeError: If exclusive lock is requested inside a shared one
+        """
+        with self._thread_lock:
+            if self._depth == 0:
+                self.acquire(exclusive)
+            elif exclusive and not self._exclusive:
+                raise RuntimeError("Shared lock can't be upgraded to exclusive")
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.release()
+
+    def generation(self) -> int:
+        """Storage generation, the lock must be held
+
+        Returns:
+            int: 0 if the storage was never written under the lock
+        """
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        data = os.read(self._fd, GENERATION.size)
+        return GENERATION.unpack(data)[0] if len(data) == GENERATION.size else 0
+
+    def bump(self) -> int:
+        """Increment storage generation, the exclusive lock must be held
+
+        Returns:
+            int: New generation
+        """
+        generation = self.generation() + 1
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, GENERATION.pack(generation))
+        return generation
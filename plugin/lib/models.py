@@ -1,28 +1,118 @@
-from dataclasses import dataclass, field, asdict
+import sys
+import binascii
+from dataclasses import dataclass, field
 
 # types
-from typing import List, Literal
+from typing import List, Literal, Union
 
 
-@dataclass
 class Entrie:
-    """OptConfig.entries one entrie
+    """OptConfig.entries one entrie. Slotted, big vaults keep tens of thousands of them in memory;
+    the encrypted key is kept as raw bytes, it's base64 encoded only by to_dict
     """
 
+    __slots__ = ('name', 'key', 'is_encrypted', 'type', 'algorithm', 'digits', 'period', 'counter', 'fingerprint')
+
     name: str
     """Name of key
     """
 
-    key: str
-    """Secret encrypted key
+    key: Union[bytes, str]
+    """Secret encrypted key, raw bytes. Unencrypted key is a str
     """
 
     is_encrypted: bool
     """Is this key is encrypted
     """
 
+    type: Literal['totp', 'hotp']
+    """Type of one time password
+    """
+
+    algorithm: str
+    """HMAC algorithm: SHA1, SHA256, SHA512 or MD5
+    """
+
+    digits: int
+    """Code length
+    """
+
+    period: int
+    """TOTP time step in seconds
+    """
+
+    counter: int
+    """HOTP counter of the next code
+    """
+
+    fingerprint: str
+    """Keyed hash of secret key to find the same account under another name
+    """
+
+    def __init__(self, name: str, key: Union[bytes, str], is_encrypted: bool, type: Literal['totp', 'hotp'] = 'totp',
+                 algorithm: str = 'SHA1', digits: int = 6, period: int = 30, counter: int = 0, fingerprint: str = ''):
+        self.name = name
+        self.key = key
+        self.is_encrypted = is_encrypted
+        self.type = type
+        self.algorithm = algorithm
+        self.digits = digits
+        self.period = period
+        self.counter = counter
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def from_dict(data: dict) -> 'Entrie':
+        """Build entry from raw config data, the encrypted key is decoded into raw bytes.
+        Repeated short strings are interned, so all entries share them
+
+        Args:
+            data (dict): Entrie fields, key is a base64 string or raw bytes
+
+        Returns:
+            Entrie
+        """
+        key = data['key']
+        if data['is_encrypted'] and isinstance(key, str):
+            key = binascii.a2b_base64(key)
+        return Entrie(
+            name=data['name'],
+            key=key,
+            is_encrypted=data['is_encrypted'],
+            type=sys.intern(data.get('type', 'totp')),
+            algorithm=sys.intern(data.get('algorithm', 'SHA1')),
+            digits=data.get('digits', 6),
+            period=data.get('period', 30),
+            counter=data.get('counter', 0),
+            fingerprint=data.get('fingerprint', ''),
+        )
+
     def to_dict(self):
-        return asdict(self)
+        key = self.key
+        if isinstance(key, bytes):
+            key = binascii.b2a_base64(key, newline=False).decode('ascii')
+        return {
+            'name': self.name,
+            'key': key,
+            'is_encrypted': self.is_encrypted,
+            'type': self.type,
+            'algorithm': self.algorithm,
+            'digits': self.digits,
+            'period': self.period,
+            'counter': self.counter,
+            'fingerprint': self.fingerprint,
+        }
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        # the key is left out, even encrypted
+        return f"Entrie(name={self.name!r}, type={self.type!r})"
 
 
 @dataclass
@@ -38,8 +128,25 @@ class OtpConfig:
     """List of encrypted migrations
     """
 
+    imported: List[str] = field(default_factory=list)
+    """Fingerprints of settings links which are already imported
+    """
+
+    salt: str = ''
+    """Hex key of entries secret fingerprints
+    """
+
+    unencrypted: List[dict] = field(default_factory=list)
+    """Raw unencrypted entries whose links failed to import, they are saved back as they are
+    """
+
     def to_dict(self):
-        return asdict(self)
+        return {
+            'version': self.version,
+            'entries': [entry.to_dict() for entry in self.entries] + [dict(entry) for entry in self.unencrypted],
+            'imported': list(self.imported),
+            'salt': self.salt,
+        }
 
 
 @dataclass
@@ -54,3 +161,61 @@ class UrlScheme:
     url: str
     """Migration link
     """
+
+
+@dataclass
+class LinkError:
+    """Settings link which failed to import
+    """
+
+    line: int
+    """Line of the link in the migration links setting, 0 if unknown
+    """
+
+    stage: Literal['classify', 'decode', 'parse']
+    """Import stage which failed
+    """
+
+    link: str
+    """Link without its secret parameters
+    """
+
+    message: str
+    """Error description
+    """
+
+    source: Literal['settings', 'storage'] = 'settings'
+    """Where the link is: the migration links setting, or an unencrypted entry of the otp config.
+    line of a storage link is the number of its entry in the otp config
+    """
+
+
+@dataclass
+class ImportReport:
+    """Result of importing settings links
+    """
+
+    links: int = 0
+    """Count of links in settings
+    """
+
+    skipped: int = 0
+    """Links which were already imported
+    """
+
+    added: int = 0
+    """New accounts
+    """
+
+    duplicates: int = 0
+    """Accounts which are already in the vault
+    """
+
+    missing_parts: int = 0
+    """Missing QR codes of multi QR migration exports
+    """
+
+    errors: List[LinkError] = field(default_factory=list)
+    """Links which failed to import. They are not added to the import ledger,
+    so every load retries them and reports them again
+    """
@@ -0,0 +1,172 @@
+import time
+import threading
+
+# libs
+from plugin.lib.codes import CodeEngine, GeneratorKey, OtpGenerator
+from plugin.lib.definitions import PRECOMPUTE_LEAD
+from plugin.lib.models import Entrie
+
+# types
+from typing import Dict, List, Optional, Tuple
+
+
+class CodeScheduler:
+    """Double-buffered table of current and next step codes of TOTP entries.
+    The background thread builds the table of the coming time step just before
+    its boundary and swaps it in at the boundary, so queries only read the table.
+    Codes are computed only for keys which are already decrypted by CodeEngine
+    """
+
+    def __init__(self, code_engine: CodeEngine, lead: float = PRECOMPUTE_LEAD):
+        """
+        Args:
+            code_engine (CodeEngine): Source of generators
+            lead (float): Seconds before the boundary when the next table is built
+        """
+        self.code_engine = code_engine
+        self.lead = lead
+        self.table: Dict[GeneratorKey, Tuple[int, Tuple[str, str]]] = {}
+        """CodeEngine.generator_key -> (time step counter, (code, next step code))
+        """
+        self.entries: List[Entrie] = []
+        self._generation = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def build_item(generator: OtpGenerator, counter: int) -> Tuple[int, Tuple[str, str]]:
+        return counter, (generator.generate(counter), generator.generate(counter + 1))
+
+    def track(self, entries: List[Entrie]):
+        """Set entries which the background thread keeps computed
+
+        Args:
+            entries (List[Entrie]): All entries of the vault
+        """
+        self.entries = entries
+
+    def lookup(self, entry: Entrie, for_time: float) -> Optional[Tuple[str, int, Optional[str]]]:
+        """Read the code of TOTP entry from the table
+
+        Returns:
+            Optional[Tuple[str, int, Optional[str]]]: (code, remaining_seconds, next_code), None if
+                the table has no code of this time step. next_code is None right after the boundary,
+                until the table is swapped
+        """
+        item = self.table.get(CodeEngine.generator_key(entry))
+        if item is None:
+            return None
+        counter = int(for_time) // entry.period
+        index = counter - item[0]
+        if index == 0:
+            return item[1][0], entry.period - int(for_time) % entry.period, item[1][1]
+        if index == 1:
+            return item[1][1], entry.period - int(for_time) % entry.period, None
+        return None
+
+    def code(self, entry: Entrie, for_time: Optional[float] = None) -> Tuple[str, Optional[int], Optional[str]]:
+        """Code of the entry from the table, computed and stored on a miss
+
+        Args:
+            entry (Entrie): Entry with encrypted key
+            for_time (Optional[float]): Unix time, now by default
+
+        Raises:
+            InvalidSecretError: If decrypted key is not base32 data
+
+        Returns:
+            Tuple[str, Optional[int], Optional[str]]: (code, remaining_seconds, next_code).
+                remaining_seconds and next_code are None for HOTP entries
+        """
+        if entry.type == 'hotp':
+            code, _ = self.code_engine.code(entry)
+            return code, None, None
+
+        if for_time is None:
+            for_time = time.time()
+        hit = self.lookup(entry, for_time)
+        if hit is not None and hit[2] is not None:
+            return hit
+
+        generator = self.code_engine.get(entry)
+        item = self.build_item(generator, generator.counter(for_time))
+        self.table[CodeEngine.generator_key(entry)] = item
+        return item[1][0], generator.remaining_seconds(for_time), item[1][1]
+
+    def build(self, for_time: float) -> Dict[GeneratorKey, Tuple[int, Tuple[str, str]]]:
+        """Build table of the time step of the moment, items which are still valid are reused
+
+        Args:
+            for_time (float): Unix time
+
+        Returns:
+            Dict[GeneratorKey, Tuple[int, Tuple[str, str]]]: New table
+        """
+        table = {}
+        current = self.table
+        for entry in self.entries:
+            if entry.type == 'hotp':
+                continue
+            generator = self.code_engine.peek(entry)
+            if generator is None:
+                continue
+            counter = int(for_time) // entry.period
+            generator_key = CodeEngine.generator_key(entry)
+            item = current.get(generator_key)
+            table[generator_key] = item if item is not None and item[0] == counter else self.build_item(generator, counter)
+        return table
+
+    def next_boundary(self, now: float) -> Optional[float]:
+        """The nearest time step boundary of tracked entries
+
+        Returns:
+            Optional[float]: Unix time, None if there are no TOTP entries
+        """
+        periods = {entry.period for entry in self.entries if entry.type != 'hotp'}
+        if not periods:
+            return None
+        return min((int(now) // period + 1) * period for period in periods)
+
+    def run(self):
+        """Build the next table before each boundary and swap it in at the boundary
+        """
+        while not self._stop.is_set():
+            # idle keys are wiped even if no query comes
+            self.code_engine.expire()
+            now = time.time()
+            boundary = self.next_boundary(now)
+            if boundary is None or boundary - now < self.lead:
+                # nothing to compute, or too late for this boundary
+                if self._stop.wait(self.lead):
+                    return
+                continue
+            if self._stop.wait(boundary - self.lead - now):
+                return
+            generation = self._generation
+            table = self.build(boundary)
+            if self._stop.wait(max(0.0, boundary - time.time())):
+                return
+            # keys could be wiped by clear() while the table was built
+            if generation == self._generation:
+                self.table = table
+
+    def start(self):
+        """Start the background thread, for the long-lived resident process
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="code-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def clear(self):
+        """Drop computed codes
+        """
+        self._generation += 1
+        self.table = {}
@@ -0,0 +1,71 @@
+# libs
+from plugin.lib.definitions import APP_ICON
+from plugin.lib.models import Entrie
+
+# types
+from typing import Dict, Tuple
+
+# flow
+from pyflowlauncher import Result
+
+ACTIONS = {
+    'totp': "copy_to_clipboard",
+    'hotp': "copy_hotp_to_clipboard",
+}
+"""JSON-RPC method of the result action by entry type
+"""
+
+
+class ResultCache:
+    """Result rows of entries. The static part of a row (icon, score, empty fields)
+    is built once per entry, title and action once per code, only the subtitle per query
+    """
+
+    def __init__(self):
+        self._rows: Dict[Tuple[str, bytes], Tuple[dict, str, str, dict]] = {}
+        """(name, encrypted key) -> (static row, code, title, action)
+        """
+
+    @staticmethod
+    def static_row() -> dict:
+        """Row without entry specific fields, fields with None values are left out of the payload
+
+        Returns:
+            dict: Result fields
+        """
+        row = Result(Title='', IcoPath=APP_ICON).as_dict()
+        return {name: value for name, value in row.items() if value is not None}
+
+    def row(self, entry: Entrie, code: str, subtitle: str) -> dict:
+        """Result row of the entry code
+
+        Args:
+            entry (Entrie): Entry
+            code (str): Current code
+            subtitle (str): Result subtitle
+
+        Returns:
+            dict: Result fields, the same as Result.as_dict() without None values
+        """
+        row_key = (entry.name, entry.key)
+        item = self._rows.get(row_key)
+        if item is None or item[1] != code:
+            static = self.static_row() if item is None else item[0]
+            action = {
+                "Method": ACTIONS[entry.type],
+                "Parameters": [code, entry.name]
+            }
+            item = (static, code, f"{code} - {entry.name}", action)
+            self._rows[row_key] = item
+
+        row = item[0].copy()
+        row['Title'] = item[2]
+        row['SubTitle'] = subtitle
+        row['JsonRPCAction'] = item[3]
+        return row
+
+    def clear(self):
+        self._rows.clear()
+
+    def __len__(self):
+        return len(self._rows)
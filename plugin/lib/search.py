@@ -0,0 +1,162 @@
+import re
+import sys
+import heapq
+
+# libs
+from plugin.lib.models import Entrie
+
+# types
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+TOKEN_SPLIT = re.compile(r'[^\w]+')
+
+
+class SearchIndex:
+    """Search index over entry names. An entry matches if every query word is a
+    subsequence of its normalized name; results are ranked by relevance. A query
+    which extends the previous one is only checked against the previous matches
+    """
+
+    def __init__(self, entries: List[Entrie] = None):
+        """
+        Args:
+            entries (List[Entrie]): Entries to index
+        """
+        self.entries: List[Entrie] = []
+        self._names: List[str] = []
+        self._issuers: List[str] = []
+        self._tokens: List[List[str]] = []
+        self._chars: Dict[str, Set[int]] = {}
+        self._last_query = ''
+        self._last_ids: List[int] = []
+
+        for entry in entries or []:
+            self.add(entry)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.casefold().split())
+
+    @staticmethod
+    def trigrams(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, entry: Entrie):
+        """Index one more entry
+
+        Args:
+            entry (Entrie)
+        """
+        entry_id = len(self.entries)
+        name = self.normalize(entry.name)
+        # names are "issuer:account", see Crypt.parse_link
+        issuer, _, account = name.partition(':')
+
+        self.entries.append(entry)
+        self._names.append(name)
+        # issuers and name tokens repeat across entries, interned they are kept once
+        self._issuers.append(sys.intern(issuer) if account else '')
+        self._tokens.append([sys.intern(token) for token in TOKEN_SPLIT.split(name) if token])
+        for char in set(name):
+            self._chars.setdefault(char, set()).add(entry_id)
+
+        self._last_query = ''
+        self._last_ids = []
+
+    @staticmethod
+    def is_subsequence(word: str, name: str) -> bool:
+        chars = iter(name)
+        return all(char in chars for char in word)
+
+    def candidates(self, query: str) -> List[int]:
+        """Ids of entries which may match the query
+
+        Args:
+            query (str): Normalized query
+
+        Returns:
+            List[int]
+        """
+        if self._last_query and query.startswith(self._last_query):
+            return self._last_ids
+
+        ids = None
+        for char in set(query.replace(' ', '')):
+            char_ids = self._chars.get(char)
+            if not char_ids:
+                return []
+            ids = set(char_ids) if ids is None else ids & char_ids
+        return sorted(ids) if ids is not None else list(range(len(self.entries)))
+
+    def score(self, entry_id: int, query: str, words: List[str]) -> int:
+        """Relevance of matched entry
+
+        Args:
+            entry_id (int): Entry id
+            query (str): Normalized query
+            words (List[str]): Query words
+
+        Returns:
+            int: Bigger is better
+        """
+        name = self._names[entry_id]
+        tokens = self._tokens[entry_id]
+        # trigrams of names are not stored, only fuzzy words need them
+        name_trigrams = None
+        score = 0
+        if name.startswith(query):
+            score += 100
+        elif self._issuers[entry_id].startswith(words[0]):
+            score += 60
+
+        for word in words:
+            if any(token.startswith(word) for token in tokens):
+                score += 30
+            elif word in name:
+                score += 20
+            else:
+                trigrams = self.trigrams(word)
+                if trigrams:
+                    if name_trigrams is None:
+                        name_trigrams = self.trigrams(name)
+                    score += 10 * len(trigrams & name_trigrams) // len(trigrams)
+        return score
+
+    def search(self, query: str, usage: Optional[Callable[[Entrie], float]] = None, limit: int = 0) -> List[Entrie]:
+        """Matched entries ordered by relevance
+
+        Args:
+            query (str): Search query
+            usage (Optional[Callable[[Entrie], float]]): Usage score of entry, used for empty query and equal relevance
+            limit (int): Max count of entries, 0 for all. Only the best entries are ordered
+
+        Returns:
+            List[Entrie]
+        """
+        query = self.normalize(query)
+        if not query:
+            if usage is None:
+                return list(self.entries[:limit] if limit > 0 else self.entries)
+            if limit > 0:
+                return heapq.nsmallest(limit, self.entries, key=lambda entry: -usage(entry))
+            return sorted(self.entries, key=lambda entry: -usage(entry))
+
+        words = query.split(' ')
+        ids = [
+            entry_id for entry_id in self.candidates(query)
+            if all(self.is_subsequence(word, self._names[entry_id]) for word in words)
+        ]
+        self._last_query = query
+        self._last_ids = ids
+
+        ranks = (
+            (-self.score(entry_id, query, words),
+             -usage(self.entries[entry_id]) if usage else 0,
+             entry_id)
+            for entry_id in ids
+        )
+        ranked: List[Tuple[int, float, int]] = heapq.nsmallest(limit, ranks) if limit > 0 else sorted(ranks)
+        return [self.entries[entry_id] for _, _, entry_id in ranked]
+
+    def __len__(self):
+        return len(self.entries)
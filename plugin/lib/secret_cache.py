@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import OrderedDict
+
+# libs
+from plugin.lib.crypt import Crypt
+from plugin.lib.definitions import SECRET_CACHE_TTL, SECRET_CACHE_SIZE
+
+# types
+from typing import List, Tuple
+
+
+class SecretCache:
+    """Bounded LRU cache of decrypted keys. Keys are kept in mutable buffers and wiped
+    when they are evicted, expired or the cache is cleared. Copies made from a buffer
+    (decoded key bytes, HMAC states of OtpGenerator) are not covered and stay in memory until freed
+    """
+
+    def __init__(self, ttl: float = SECRET_CACHE_TTL, max_size: int = SECRET_CACHE_SIZE):
+        """
+        Args:
+            ttl (float): Seconds a key may stay unused before it is wiped
+            max_size (int): Max count of decrypted keys in memory
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._secrets: "OrderedDict[bytes, Tuple[bytearray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def wipe(buffer: bytearray):
+        """Overwrite buffer with zeros in place
+
+        Args:
+            buffer (bytearray)
+        """
+        buffer[:] = bytes(len(buffer))
+
+    def get(self, encrypted: bytes) -> bytearray:
+        """Get decrypted key, decrypt it only if it is not cached yet
+
+        Args:
+            encrypted (bytes): Encrypted key, Entrie.key
+
+        Returns:
+            bytearray: Decrypted key, do not keep a reference to it
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._secrets.get(encrypted)
+            if item is not None:
+                self._secrets[encrypted] = (item[0], now)
+                self._secrets.move_to_end(encrypted)
+                return item[0]
+
+        buffer = Crypt.decrypt_key_buffer(encrypted)
+        with self._lock:
+            item = self._secrets.get(encrypted)
+            if item is not None:
+                # decrypted by another thread meanwhile
+                self.wipe(buffer)
+                return item[0]
+            self._secrets[encrypted] = (buffer, now)
+            while len(self._secrets) > self.max_size:
+                _, (evicted, _) = self._secrets.popitem(last=False)
+                self.wipe(evicted)
+        return buffer
+
+    def preload(self, encrypted_list: List[bytes]):
+        """Decrypt all not cached keys in one batch
+
+        Args:
+            encrypted_list (List[bytes]): Encrypted keys
+        """
+        with self._lock:
+            missing = list(dict.fromkeys(
+                encrypted for encrypted in encrypted_list if encrypted not in self._secrets))
+        if not missing:
+            return
+
+        buffers = Crypt.decrypt_many(missing)
+        now = time.monotonic()
+        with self._lock:
+            for encrypted, buffer in zip(missing, buffers):
+                if encrypted in self._secrets:
+                    self.wipe(buffer)
+                    continue
+                self._secrets[encrypted] = (buffer, now)
+            while len(self._secrets) > self.max_size:
+                _, (evicted, _) = self._secrets.popitem(last=False)
+                self.wipe(evicted)
+
+    def _expire(self, now: float):
+        """Wipe keys which was not used for ttl seconds
+        """
+        while self._secrets:
+            encrypted, (buffer, last_used) = next(iter(self._secrets.items()))
+            if now - last_used < self.ttl:
+                break
+            del self._secrets[encrypted]
+            self.wipe(buffer)
+
+    def clear(self):
+        """Wipe all decrypted keys
+        """
+        with self._lock:
+            for buffer, _ in self._secrets.values():
+                self.wipe(buffer)
+            self._secrets.clear()
+
+    def __len__(self):
+        return len(self._secrets)
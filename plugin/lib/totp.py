@@ -1,15 +1,19 @@
 import os
-import pyotp
-from urllib.parse import urlparse
+import hashlib
+import itertools
+from contextlib import contextmanager
 
 # libs
 from plugin.lib import Crypt, Files
-from plugin.lib.models import Entrie, UrlScheme, OtpConfig
-from plugin.lib.definitions import OTP_CONFIG_PATH, OTP_SCHEME_TO_TYPE
-from plugin.migration_decoder.decoder import decode
+from plugin.lib.entry_index import EntryIndex
+from plugin.lib.secret_cache import SecretCache
+from plugin.lib.instrument import timings
+from plugin.lib.importer import Importer
+from plugin.lib.models import Entrie, ImportReport, LinkError, OtpConfig
+from plugin.lib.definitions import IMPORT_CHUNK_SIZE, OTP_CONFIG_VERSION
 
 # types
-from typing import Union, List
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union, List
 
 # flow
 from pyflowlauncher import Plugin
@@ -23,15 +27,131 @@ class Totp:
             settings (pyflowlauncher.Plugin().settings): Plugin settings
         """
         self.settings = settings
+        self._transaction = 0
+        self._journal_records = []
+        self._full_save = False
+        self.import_report = ImportReport()
+        self.storage_errors: List[LinkError] = []
+        """Unencrypted entries of the otp config which failed to import, see encrypt_unencripted_data
+        """
+        self.generation = 0
+        self.on_commit: Optional[Callable[[], None]] = None
+        """Called after own storage writes, under the exclusive storage lock, see Vault
+        """
+        Files.set_binary(self.use_binary_storage)
         self.run()
 
     def run(self, ):
         """Load storage, parse settings, etc...
         """
         self.otp_data = self.load_storage()
-        self.otpauth_links = []
-        self.urls = self.parse_settings_urls()
-        self.handle_auth_import(urls=self.urls)
+        with timings.phase('links_parse'):
+            self.urls = self.parse_settings_urls()
+        with timings.phase('import'):
+            self.handle_auth_import(urls=self.urls)
+
+    @property
+    def use_journal(self) -> bool:
+        """Storage changes are appended to the journal instead of rewriting OTPList.json
+        """
+        return str(self.settings.get('storageJournal', False)).lower() == 'true'
+
+    @property
+    def use_binary_storage(self) -> bool:
+        """Otp config is stored in binary OTPList.bin instead of OTPList.json
+        """
+        return str(self.settings.get('binaryStorage', False)).lower() == 'true'
+
+    @contextmanager
+    def transaction(self):
+        """Group storage changes, they are written once at the end. If the block raises, nothing is written:
+        the remembered changes are dropped and the storage is loaded again, so the in-memory data matches it
+        """
+        self._transaction += 1
+        try:
+            yield
+        except BaseException:
+            if self._transaction == 1:
+                self.rollback()
+            raise
+        finally:
+            self._transaction -= 1
+        if not self._transaction:
+            self.commit()
+
+    def rollback(self):
+        """Drop remembered storage changes and reload the storage they were made on
+        """
+        self._journal_records = []
+        self._full_save = False
+        self.otp_data = self.load_storage()
+
+    def mark_changed(self, record: Optional[dict] = None):
+        """Remember storage change and write it, unless a transaction is open
+
+        Args:
+            record (Optional[dict]): Journal record of the change (see Files.replay_journal). None needs a full rewrite
+        """
+        if record is None:
+            self._full_save = True
+        else:
+            self._journal_records.append(record)
+        if not self._transaction:
+            self.commit()
+
+    def commit(self):
+        """Write remembered storage changes. If another plugin process has written the storage
+        since it was loaded, the changes are merged into the current storage
+        """
+        if not self._full_save and not self._journal_records:
+            return
+
+        with Files.lock.hold(exclusive=True):
+            conflict = Files.lock.generation() != self.generation
+            journal_size = 0
+            if self.use_journal and not self._full_save:
+                journal_size = Files.append_journal(records=self._journal_records)
+            elif conflict:
+                self.merge_storage()
+            else:
+                Files.save_storage(data=self.otp_data)
+            if conflict:
+                # load changes of the other process
+                self.otp_data = self.load_known_storage_data()
+            self.generation = Files.lock.generation()
+            self._journal_records = []
+            self._full_save = False
+
+            if Files.need_compaction(journal_size):
+                # the journal is moved aside under the lock, the merge runs in the background
+                Files.compact_journal(on_done=self.compacted)
+            if self.on_commit is not None:
+                self.on_commit()
+
+    def compacted(self, generation: int):
+        """Journal compaction is written, see Files.compact_journal. The loaded data still matches
+        the storage if no other process wrote it in between
+
+        Args:
+            generation (int): Storage generation before the compaction was written
+        """
+        if generation != self.generation:
+            return
+        self.generation = Files.lock.generation()
+        if self.on_commit is not None:
+            self.on_commit()
+
+    def merge_storage(self):
+        """Apply remembered changes to the current storage instead of rewriting it with the loaded data.
+        Full rewrite changes (salt, fingerprints) are dropped, fingerprints are regenerated on the next import
+        """
+        data = Files.read_otp_config()
+        if data.get('salt', '') != self.otp_data.salt:
+            for record in self._journal_records:
+                if record.get('op') == 'add':
+                    record['entry']['fingerprint'] = ''
+        Files.apply_records(data=data, records=self._journal_records)
+        Files.save_raw_storage(data=data)
 
     def parse_settings_urls(self, ):
         """Parsing migration links from user settings field
@@ -45,42 +165,51 @@ class Totp:
 
         data = []
         for i in url_string.split('\n'):
+            # blank lines may keep spaces or the \r of CRLF line breaks
+            i = i.strip()
             if not i:
                 continue
-            data.append(i.strip())
+            data.append(i)
         return data
 
-    def encrypt_unencripted_data(self, data: list):
-        """Propably config json contains unencrypted data, then encrypt it!
+    def encrypt_unencripted_data(self, data: list) -> Tuple[list, list]:
+        """Propably config json contains unencrypted data, then encrypt it! Their links are imported
+        like settings links, a failed link is reported in self.storage_errors and its entry is kept as it is
 
         Args:
             data (list): list of entries (not Entrie!)
 
         Returns:
-            list
+            Tuple[list, list]: (encrypted entries, unencrypted entries which failed)
         """
-        unencrypted_links = []
-        result = []
-        for obj in data:
-            if obj.get('is_encrypted'):
-                continue
-            unencrypted_links.append(obj.get('key'))
-
-        if len(unencrypted_links) < 1:
-            return result
-
-        urls_schemes = self.generate_urls_scheme(urls=unencrypted_links)
-        otpauth_links = self.generate_otpauth_links(urls=urls_schemes)
+        report = ImportReport()
+        self.storage_errors = report.errors
+        unencrypted = [obj for obj in data if not obj.get('is_encrypted')]
+        if not unencrypted:
+            return [], []
+
+        # errors are matched to their entries by the entry number in the otp config
+        lines = {}
+        for number, obj in enumerate(data, start=1):
+            if not obj.get('is_encrypted'):
+                lines.setdefault(obj.get('key') or '', number)
+        decoded = Importer.decode_many(Importer.classify(list(lines), report=report, lines=lines))
+        accounts = list(Importer.accounts(decoded, report=report, lines=lines))
 
-        for opt_link in otpauth_links:
-            enc_key, name = Crypt.ecrypt_data(link=opt_link)
+        result = []
+        for enc_key, name, options in Crypt.encrypt_accounts(accounts=accounts):
             result.append({
                 "name": name,
                 "key": enc_key,
-                "is_encrypted": True
+                "is_encrypted": True,
+                **options
             })
 
-        return result
+        for error in report.errors:
+            error.source = 'storage'
+        failed_lines = {error.line for error in report.errors}
+        failed = [obj for obj in unencrypted if lines[obj.get('key') or ''] in failed_lines]
+        return result, failed
 
     def load_known_storage_data(self, ):
         """If we found otp config file, read and convert to OtpConfig dataclass. If entries contains unencrypted data, then we resave config json
@@ -88,28 +217,43 @@ class Totp:
         Returns:
             OptConfig
         """
-        is_unencrypted_exist = False
-        data = Files.read_otp_config()
-        data['entries'] += self.encrypt_unencripted_data(
-            data=data['entries']
+        # generation is taken first, a write in between only causes a needless merge
+        self.generation = Files.generation()
+        data = Files.read_otp_config(raw_keys=True)
+        entries = data['entries']
+        encrypted, failed = self.encrypt_unencripted_data(
+            data=entries
         )
-        unique_entries = {}
-        # get only unique encrypted generated entries plus if the data included unencrypted data, we write this to the flag
-        for item in data['entries']:
-            if item['is_encrypted']:
-                unique_entries[item['name']] = item
-            else:
-                is_unencrypted_exist = True
-        # get only encrypted entries
-        unique_encrypted_list = list(unique_entries.values())
+        entries += encrypted
+        index = EntryIndex()
+        # one pass: every raw dict is replaced by its entry in place, so the vault is not kept twice while loading.
+        # Only encrypted entries are kept, failed unencrypted entries are kept aside as they are
+        count = 0
+        for item in entries:
+            if not item['is_encrypted']:
+                continue
+            entry = Entrie.from_dict(item)
+            index.add(entry)
+            entries[count] = entry
+            count += 1
+        del entries[count:]
+        if len(index) != count:
+            # entries with the same name, the later one wins
+            entries = index.entries()
         data = OtpConfig(
             version=data['version'],
-            entries=[Entrie(**entrie) for entrie in unique_encrypted_list]
+            entries=entries,
+            imported=data.get('imported', []),
+            salt=data.get('salt', ''),
+            unencrypted=failed
         )
+        self.index = index
 
         # if we have previously decrypted data, then resave storage with new encrypted data
-        if is_unencrypted_exist:
-            Files.save_storage(data=data)
+        if encrypted:
+            with Files.lock.hold(exclusive=True):
+                Files.save_storage(data=data)
+                self.generation = Files.lock.generation()
         return data
 
     def load_storage(self):
@@ -118,8 +262,14 @@ class Totp:
         Returns:
             OptConfig
         """
-        if not os.path.exists(OTP_CONFIG_PATH):
-            return Files.load_empty_storage_data()
+        Files.migrate_storage()
+        if not os.path.exists(Files.config_path()):
+            with Files.lock.hold(exclusive=True):
+                data = Files.load_empty_storage_data()
+                self.generation = Files.lock.generation()
+            if data is not None:
+                self.index = EntryIndex()
+                return data
 
         return self.load_known_storage_data()
 
@@ -132,100 +282,205 @@ class Totp:
         Returns:
             bool
         """
+        import pyotp
+
         try:
             pyotp.TOTP(key)
             return True
         except:
             return False
 
-    def add_to_list(self, name: str, secret: str):
+    def add_to_list(self, name: str, secret: str, options: Optional[dict] = None):
         """Apply new opt data to entries. Plus save in json file
 
         Args:
             name (str): Name of key
             secret (str): Secret key
+            options (Optional[dict]): Code options (Entrie fields: type, algorithm, digits, period, counter, fingerprint)
         """
-        # Check for a record with the same name
-        for entry in self.otp_data.entries:
-            if entry.name == name:
-                return
-
-        self.otp_data.entries.append(
-            Entrie(
-                name=name,
-                key=secret,
-                is_encrypted=True
-            )
+        options = options or {}
+        # Check for a record with the same name or the same secret
+        if self.index.contains(name=name, fingerprint=options.get('fingerprint')):
+            return
+
+        entry = Entrie(
+            name=name,
+            key=Crypt.blob(secret),
+            is_encrypted=True,
+            **options
         )
-        Files.save_storage(data=self.otp_data)
+        self.otp_data.entries.append(entry)
+        self.index.add(entry)
+        self.mark_changed(record={"op": "add", "entry": entry.to_dict()})
 
-    def google_migration_decoder(self, url):
-        """Google migration link decoder
+    def ensure_fingerprints(self):
+        """Generate fingerprints salt and fingerprints of entries which have none yet (decrypts them in one batch).
+        Entries whose keys can't be decrypted are left without fingerprint
+        """
+        if not self.otp_data.salt or self.otp_data.version < OTP_CONFIG_VERSION:
+            # no fingerprints yet, or they don't cover code options
+            self.otp_data.salt = self.otp_data.salt or Files.new_salt()
+            self.otp_data.version = OTP_CONFIG_VERSION
+            for entry in self.otp_data.entries:
+                entry.fingerprint = ''
+            self.index = EntryIndex(self.otp_data.entries)
+            self.mark_changed()
+
+        missing = [entry for entry in self.otp_data.entries if not entry.fingerprint]
+        if not missing:
+            return
 
-        Args:
-            url (str): Migration link from Google Authentificator
+        try:
+            secrets = Crypt.decrypt_many([entry.key for entry in missing])
+        except Exception:
+            # one undecryptable key (another user's vault, corrupted blob) must not abort the import
+            secrets = [self.try_decrypt(entry.key) for entry in missing]
+        changed = False
+        for entry, secret in zip(missing, secrets):
+            if secret is None:
+                # left without fingerprint, it's retried on the next import
+                continue
+            entry.fingerprint = self.entry_fingerprint(secret, entry)
+            SecretCache.wipe(secret)
+            self.index.add(entry)
+            changed = True
+        if changed:
+            self.mark_changed()
+
+    def entry_fingerprint(self, secret: Union[str, bytes, bytearray], entry: Entrie) -> str:
+        """Fingerprint of the entry secret and code options, see Crypt.secret_fingerprint
+
+        Returns:
+            str: Hex fingerprint
+        """
+        return Crypt.secret_fingerprint(
+            secret, salt=self.otp_data.salt, type=entry.type, algorithm=entry.algorithm,
+            digits=entry.digits, period=entry.period)
+
+    @staticmethod
+    def try_decrypt(encrypted: bytes) -> Optional[bytearray]:
+        """Decrypt one key, see ensure_fingerprints
 
         Returns:
-            str: otpauth://... link
+            Optional[bytearray]: None if the key can't be decrypted
         """
-        return decode(url)
+        try:
+            return Crypt.decrypt_key_buffer(encrypted)
+        except Exception:
+            return None
 
-    def generate_urls_scheme(self, urls: Union[List[str], List]) -> Union[List[UrlScheme], List]:
-        """Let's check what type of link was passed by the user
+    def encrypt_new_accounts(self, accounts: Iterable[Tuple[str, str, dict]]) -> List[Tuple[str, str, dict]]:
+        """Encrypt only accounts which are not in the vault yet
 
         Args:
-            urls (Union[List[str], List]): List of otps links
+            accounts (Iterable[Tuple[str, str, dict]]): [(key, name, options), ...], see Crypt.parse_link
 
         Returns:
-            Union[List[UrlScheme], List]
+            List[Tuple[str, str, dict]]: [(enc_key, f"{issuer}:{second_name}", options), ...]
         """
-        result = []
-        for url in urls:
-            parsed_url = urlparse(url)
-            t = OTP_SCHEME_TO_TYPE.get(parsed_url.scheme)
-            if t:
-                result.append(UrlScheme(type=t, url=url))
+        new_index = EntryIndex()
+        new_accounts = []
+        for key, name, options in accounts:
+            entry = Entrie(name=name, key='', is_encrypted=False, **options)
+            entry.fingerprint = options['fingerprint'] = self.entry_fingerprint(key, entry)
+            if self.index.contains(name=name, fingerprint=entry.fingerprint) \
+                    or new_index.contains(name=name, fingerprint=entry.fingerprint):
+                continue
+            new_index.add(entry)
+            new_accounts.append((key, name, options))
+
+        return Crypt.encrypt_accounts(accounts=new_accounts)
+
+    def increment_counter(self, name: str):
+        """Move HOTP entry to the next code. Plus save in json file
 
-        return result
+        Args:
+            name (str): Name of key
+        """
+        entry = self.index.get(name)
+        if entry is not None and entry.type == 'hotp':
+            entry.counter += 1
+            self.mark_changed(
+                record={"op": "counter", "name": name, "counter": entry.counter})
 
-    def generate_otpauth_links(self, urls: List[UrlScheme]) -> List[str]:
-        """We will find all the migration links
+    @staticmethod
+    def import_fingerprint(url: str) -> str:
+        """Fingerprint of raw settings link for the import ledger
 
         Args:
-            urls (List[UrlScheme]): List of "otpauth://" or "otpauth-migration://" links (UrlScheme)
+            url (str): Link provided by user from settings
 
         Returns:
-            List[str]: List of parsed migration links. Ex: ["otpauth://...", "otpauth://..."]
-        """
-        links = []
-        # we will find all the links
-        for obj in urls:
-            _type = obj.type
-            url = obj.url
-            if _type == 'google':
-                links += self.google_migration_decoder(url=url)
-            elif _type == 'default':
-                links += [url]
-            else:
-                continue
+            str: sha256 hex digest
+        """
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
 
-        return links
+    def settings_lines(self) -> Dict[str, int]:
+        """Line numbers of links in the migration links setting
+
+        Returns:
+            Dict[str, int]: Stripped link -> first line number, starting from 1
+        """
+        lines = {}
+        for number, line in enumerate((self.settings.get('otpauthLinks', None) or '').split('\n'), start=1):
+            lines.setdefault(line.strip(), number)
+        return lines
 
     def handle_auth_import(self, urls: Union[str, List]):
-        """Get "otpauth://" links and save in config json
+        """Get "otpauth://" links and save in config json. Links which are already in the import ledger are skipped before any parsing.
+        Links are checked concurrently and their accounts are streamed in chunks. A failed link is reported in self.import_report
+        and kept out of the ledger, so it's retried and reported again by every load until it's fixed or removed.
+        The other links are imported in one storage commit
 
         Args:
             urls (Union[List[UrlScheme], List]): Links provided by user from settings
         """
+        self.import_report = report = ImportReport(links=len(urls or []), errors=list(self.storage_errors))
         if not urls:
             return
 
-        urls_schemes = self.generate_urls_scheme(urls=urls)
-        otpauth_links = self.generate_otpauth_links(urls=urls_schemes)
+        imported = set(self.otp_data.imported)
+        new_urls = []
+        skipped = []
+        for url in urls:
+            fingerprint = self.import_fingerprint(url)
+            if fingerprint in imported:
+                report.skipped += 1
+                skipped.append(url)
+                continue
+            imported.add(fingerprint)
+            new_urls.append(url)
 
-        if otpauth_links:
-            self.otpauth_links += otpauth_links
+        if not new_urls:
+            return
 
-        for otpauth_link in self.otpauth_links:
-            enc_key, name = Crypt.ecrypt_data(link=otpauth_link)
-            self.add_to_list(name=name, secret=enc_key)
+        lines = self.settings_lines()
+        decoded = Importer.decode_many(Importer.classify(new_urls, report=report, lines=lines))
+        accounts = Importer.accounts(decoded, report=report, lines=lines, skipped=skipped)
+
+        # one storage write for the whole import
+        with self.transaction():
+            fingerprinted = False
+            # accounts are streamed and encrypted in chunks, so memory is bounded for big exports
+            while True:
+                chunk = list(itertools.islice(accounts, IMPORT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                if not fingerprinted:
+                    self.ensure_fingerprints()
+                    fingerprinted = True
+                new_accounts = self.encrypt_new_accounts(accounts=chunk)
+                report.added += len(new_accounts)
+                report.duplicates += len(chunk) - len(new_accounts)
+                for enc_key, name, options in new_accounts:
+                    self.add_to_list(name=name, secret=enc_key, options=options)
+
+            # errors know the line of their link only
+            failed_lines = {error.line for error in report.errors if error.source == 'settings'}
+            new_fingerprints = [self.import_fingerprint(url) for url in new_urls
+                                if lines.get(url, 0) not in failed_lines]
+            if new_fingerprints:
+                self.otp_data.imported += new_fingerprints
+                self.mark_changed(
+                    record={"op": "imported", "fingerprints": new_fingerprints})
+        report.errors.sort(key=lambda error: (error.source, error.line))
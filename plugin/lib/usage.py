@@ -0,0 +1,142 @@
+import os
+import time
+import struct
+import hashlib
+import threading
+
+# libs
+from plugin.lib.definitions import (
+    USAGE_PATH,
+    USAGE_HALF_LIFE,
+    USAGE_MAX_RECORDS,
+)
+from plugin.lib.watcher import FileWatcher
+
+# types
+from typing import Dict, Optional, Tuple
+
+RECORD = struct.Struct('<16sdd')
+"""Usage record: name hash, unix time, weight
+"""
+
+MIN_WEIGHT = 0.01
+"""Decayed weights below this are dropped on compaction
+"""
+
+
+class UsageStore:
+    """Frecency of copied entries. Every copy appends a fixed width record to a
+    binary sidecar file, the score is the sum of weights halved every half life.
+    Names are stored as hashes only
+    """
+
+    def __init__(self, path: str = USAGE_PATH, half_life: float = USAGE_HALF_LIFE,
+                 max_records: int = USAGE_MAX_RECORDS, watcher: Optional[FileWatcher] = None):
+        """
+        Args:
+            path (str): Sidecar file
+            half_life (float): Seconds after which a copy counts half
+            max_records (int): Records count which triggers compaction
+            watcher (Optional[FileWatcher]): Source of the sidecar stamp
+        """
+        self.path = path
+        self.watcher = watcher or FileWatcher()
+        self.half_life = half_life
+        self.max_records = max_records
+        self._records: Dict[bytes, Tuple[float, float]] = {}
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._keys: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def name_key(self, name: str) -> bytes:
+        key = self._keys.get(name)
+        if key is None:
+            key = hashlib.blake2b(name.encode('utf-8'), digest_size=16).digest()
+            self._keys[name] = key
+        return key
+
+    def decay(self, weight: float, timestamp: float, now: float) -> float:
+        return weight * 0.5 ** (max(now - timestamp, 0) / self.half_life)
+
+    def file_stamp(self) -> Optional[Tuple[int, int]]:
+        return self.watcher.stamp(self.path)
+
+    def load(self):
+        """Read the sidecar if it was changed, records are folded into one (time, weight) per name
+        """
+        stamp = self.file_stamp()
+        if stamp == self._stamp:
+            return
+
+        records: Dict[bytes, Tuple[float, float]] = {}
+        if stamp is not None:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            # a torn last record of an interrupted append is ignored
+            size = len(data) - len(data) % RECORD.size
+            for key, timestamp, weight in RECORD.iter_unpack(data[:size]):
+                records[key] = self.fold(records.get(key), timestamp, weight)
+        self._records = records
+        self._stamp = stamp
+
+    def fold(self, record: Optional[Tuple[float, float]], timestamp: float, weight: float) -> Tuple[float, float]:
+        """Merge one more record into (time, weight) of a name
+        """
+        if record is None:
+            return timestamp, weight
+        last_time, last_weight = record
+        latest = max(last_time, timestamp)
+        return latest, self.decay(last_weight, last_time, latest) + self.decay(weight, timestamp, latest)
+
+    def record(self, name: str, now: Optional[float] = None):
+        """Count one use of the entry
+
+        Args:
+            name (str): Name of key
+            now (Optional[float]): Unix time, now by default
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(RECORD.pack(self.name_key(name), now, 1.0))
+                size = f.tell()
+            self.watcher.refresh(self.path)
+            if size // RECORD.size > self.max_records:
+                self.compact()
+
+    def compact(self):
+        """Rewrite the sidecar with one record per name, forgotten names are dropped
+        """
+        self._stamp = None
+        self.load()
+        now = max([time.time()] + [timestamp for timestamp, _ in self._records.values()])
+        data = b''.join(
+            RECORD.pack(key, now, weight)
+            for key, weight in (
+                (key, self.decay(weight, timestamp, now))
+                for key, (timestamp, weight) in self._records.items()
+            )
+            if weight >= MIN_WEIGHT
+        )
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        self.watcher.refresh(self.path)
+        self._stamp = None
+
+    def score(self, name: str, now: Optional[float] = None) -> float:
+        """Frecency score of the entry
+
+        Args:
+            name (str): Name of key
+            now (Optional[float]): Unix time, now by default
+
+        Returns:
+            float: 0 if the entry was never used
+        """
+        record = self._records.get(self.name_key(name))
+        if record is None:
+            return 0.0
+        return self.decay(record[1], record[0], time.time() if now is None else now)
@@ -1,10 +1,20 @@
-import pyperclip
+# libs
+from plugin.lib.usage import UsageStore
 
+# types
+from typing import Optional
 
-def copy_to_clipboard(text: str):
+
+def copy_to_clipboard(text: str, name: Optional[str] = None):
     """Copy to clipboard
 
     Args:
         text (str)
+        name (Optional[str]): Name of copied key, counted for the results ranking
     """
+    # loaded only on copy, queries don't need it
+    import pyperclip
+
     pyperclip.copy(text)
+    if name:
+        UsageStore().record(name=name)
@@ -0,0 +1,110 @@
+# libs
+from plugin.lib.totp import Totp
+from plugin.lib.files import Files
+from plugin.lib.search import SearchIndex
+from plugin.lib.render import ResultCache
+from plugin.lib.watcher import FileWatcher
+from plugin.lib.models import OtpConfig
+from plugin.lib.definitions import OTP_JOURNAL_PATH
+
+# types
+from typing import Optional, Tuple
+
+# flow
+from pyflowlauncher import Plugin
+
+
+class Vault:
+    """Long-lived holder of the loaded Totp app. Keeps OtpConfig in memory and
+    rebuilds it only when the otp config file or the migration links setting changes
+    """
+
+    def __init__(self, watcher: Optional[FileWatcher] = None):
+        """
+        Args:
+            watcher (Optional[FileWatcher]): Source of storage files stamps
+        """
+        self.app: Optional[Totp] = None
+        self.data: Optional[OtpConfig] = None
+        """Otp config data the search index is built of
+        """
+        self.index = SearchIndex()
+        self.rows = ResultCache()
+        self.watcher = watcher or FileWatcher()
+        self.stamp: Optional[tuple] = None
+        self.links: Optional[str] = None
+
+    def storage_stamp(self) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """Current stamps of the otp config file and its journal
+
+        Returns:
+            Tuple: (config stamp, journal stamp)
+        """
+        return self.watcher.stamp(Files.config_path()), self.watcher.stamp(OTP_JOURNAL_PATH)
+
+    def is_stale(self, settings: Plugin.settings) -> bool:
+        """Check if loaded data no longer matches the storage or the settings
+
+        Args:
+            settings (pyflowlauncher.Plugin().settings): Plugin settings
+
+        Returns:
+            bool
+        """
+        if self.app is None:
+            return True
+        if settings.get('otpauthLinks', None) != self.links:
+            return True
+        if (str(settings.get('binaryStorage', False)).lower() == 'true') != Files.binary:
+            return True
+        return self.storage_stamp() != self.stamp
+
+    def get(self, settings: Plugin.settings) -> Totp:
+        """Return loaded Totp app, reload it only if needed
+
+        Args:
+            settings (pyflowlauncher.Plugin().settings): Plugin settings
+
+        Returns:
+            Totp
+        """
+        if self.is_stale(settings):
+            self.app = None
+            app = Totp(settings=settings)
+            app.on_commit = self.committed
+            # take the stamp after loading, Totp may resave the storage
+            self.watcher.refresh(Files.config_path(), OTP_JOURNAL_PATH)
+            self.stamp = self.storage_stamp()
+            self.links = settings.get('otpauthLinks', None)
+            self.data = app.otp_data
+            self.index = SearchIndex(app.otp_data.entries)
+            self.rows = ResultCache()
+            self.app = app
+        else:
+            self.app.settings = settings
+        return self.app
+
+    def committed(self):
+        """Own write of the loaded app (counter change, journal compaction), called under the storage lock.
+        The stamps are refreshed, so the next get() doesn't reload the vault. If the commit has loaded
+        changes of another process, the search index is rebuilt
+        """
+        app = self.app
+        if app is None:
+            return
+        self.watcher.refresh(Files.config_path(), OTP_JOURNAL_PATH)
+        self.stamp = self.storage_stamp()
+        if app.otp_data is not self.data:
+            self.data = app.otp_data
+            self.index = SearchIndex(app.otp_data.entries)
+            self.rows = ResultCache()
+
+    def reset(self):
+        """Drop loaded data, next get() will reload it
+        """
+        self.app = None
+        self.data = None
+        self.index = SearchIndex()
+        self.rows = ResultCache()
+        self.stamp = None
+        self.links = None
@@ -0,0 +1,90 @@
+import os
+import threading
+
+# libs
+from plugin.lib.definitions import WATCH_INTERVAL
+
+# types
+from typing import Dict, Optional, Tuple
+
+
+class FileWatcher:
+    """Stamps (mtime, size) of watched files. While the background thread runs, the
+    files are polled every interval and stamp() answers from memory, so queries don't
+    touch the disk and edits made outside the plugin are noticed within the interval.
+    Without the thread every stamp() is a stat call
+    """
+
+    def __init__(self, interval: float = WATCH_INTERVAL):
+        """
+        Args:
+            interval (float): Seconds between polls
+        """
+        self.interval = interval
+        self._stamps: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def file_stamp(path: str) -> Optional[Tuple[int, int]]:
+        """Current (mtime, size) of the file
+
+        Returns:
+            Optional[Tuple[int, int]]: None if the file does not exist
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stamp(self, path: str) -> Optional[Tuple[int, int]]:
+        """Stamp of the file, the file is watched from the first call
+
+        Args:
+            path (str): File
+
+        Returns:
+            Optional[Tuple[int, int]]: None if the file does not exist
+        """
+        if not self.running:
+            return self.file_stamp(path)
+        try:
+            return self._stamps[path]
+        except KeyError:
+            stamp = self._stamps[path] = self.file_stamp(path)
+            return stamp
+
+    def refresh(self, *paths: str):
+        """Stat files now, all watched files by default. Called after own writes,
+        so they are not taken for external edits
+
+        Args:
+            paths (str): Files
+        """
+        for path in paths or list(self._stamps):
+            self._stamps[path] = self.file_stamp(path)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def start(self):
+        """Start polling in the background thread, for the long-lived resident process
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        self.refresh()
+        self._thread = threading.Thread(target=self.run, name="file-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -3,10 +3,13 @@ from base64 import (
     b64decode,
 )
 from collections.abc import Generator
+from dataclasses import dataclass, field
 from typing import (
     Any,
     Dict,
+    Iterable,
     List,
+    Set,
     Union,
 )
 from urllib.parse import (
@@ -66,6 +69,8 @@ def get_url_params(otp: Payload.OtpParameters) -> str:
     if otp.secret:
         otp_secret = decode_secret(otp.secret)
         params.update(secret=otp_secret)
+    if OtpType.get(otp.type) == 'hotp':
+        params.update(counter=otp.counter)
 
     return urlencode(params)
 
@@ -88,15 +93,90 @@ def validate_migration(migration: str) -> list[str]:
     return qs[PAYLOAD_MARK]
 
 
-def decode(migration_data: list[str]):
-    """Convert Google Authenticator data to plain otpauth links"""
+def iter_payloads(migration: str) -> Generator:
+    """Yield parsed Payload of every data item of a migration link one by one"""
 
-    migration_data = validate_migration(migration_data)
-    data = []
-    for payload in decoded_data(data=migration_data):
+    for payload in decoded_data(data=validate_migration(migration)):
         migration_payload = Payload()
         migration_payload.ParseFromString(payload)
+        yield migration_payload
+
+
+@dataclass
+class OtpAccount:
+    """One account of a migration payload, without the otpauth url round trip"""
+
+    secret: str
+    name: str
+    issuer: str
+    algorithm: str
+    digits: int
+    type: str
+    counter: int
+
+
+def get_account(otp: Payload.OtpParameters) -> OtpAccount:
+    return OtpAccount(
+        secret=decode_secret(otp.secret),
+        name=otp.name,
+        issuer=otp.issuer,
+        algorithm=Algorithm.get(otp.algorithm, 'SHA1'),
+        digits=int(DigitCount.get(otp.digits, '6')),
+        type=OtpType.get(otp.type, 'totp'),
+        counter=otp.counter,
+    )
+
+
+@dataclass
+class BatchAssembler:
+    """Reassembles multi QR exports: payloads sharing batch_id, numbered by batch_index of batch_size.
+    A payload which was already seen is skipped"""
+
+    seen: Dict[int, Set[int]] = field(default_factory=dict)
+    sizes: Dict[int, int] = field(default_factory=dict)
+
+    def add(self, payload: Payload) -> bool:
+        """Register payload, returns False if this part of the batch was already added"""
+        if payload.batch_size <= 1:
+            return True
+
+        parts = self.seen.setdefault(payload.batch_id, set())
+        if payload.batch_index in parts:
+            return False
+        parts.add(payload.batch_index)
+        self.sizes[payload.batch_id] = payload.batch_size
+        return True
+
+    def missing(self) -> Dict[int, List[int]]:
+        """Missing batch_index values of every incomplete batch"""
+        return {
+            batch_id: [i for i in range(size) if i not in self.seen[batch_id]]
+            for batch_id, size in self.sizes.items()
+            if len(self.seen[batch_id]) < size
+        }
 
+    def is_complete(self) -> bool:
+        return not self.missing()
+
+
+def iter_accounts(migrations: Iterable[str], assembler: Union[BatchAssembler, None] = None) -> Generator:
+    """Yield OtpAccount of every migration link one by one, parts of a multi QR export may come in any order"""
+
+    if assembler is None:
+        assembler = BatchAssembler()
+    for migration in migrations:
+        for payload in iter_payloads(migration):
+            if not assembler.add(payload):
+                continue
+            for otp_item in payload.otp_parameters:
+                yield get_account(otp_item)
+
+
+def decode(migration_data: list[str]):
+    """Convert Google Authenticator data to plain otpauth links"""
+
+    data = []
+    for migration_payload in iter_payloads(migration_data):
         for otp_item in migration_payload.otp_parameters:
             data.append(get_otpauth_url(otp_item))
 
@@ -0,0 +1,330 @@
+"""Opt-in resident mode: a local server process keeps the vault, decrypted keys and
+code generators in memory, main.py only forwards JSON-RPC requests to it.
+Keep this module light, the client side runs on every keystroke: modules which only
+the client with resident mode on or the server need are imported where they are used.
+"""
+import os
+import sys
+import json
+import time
+
+SERVE_ARG = "--serve"
+"""main.py argument to start the server
+"""
+
+KEY_PATH = "OTPResident.key"
+"""Auth key of the running server, readable by the current user only
+"""
+
+LOCK_PATH = "OTPResident.lock"
+"""Held exclusively by the running server, so only one process binds the address
+"""
+
+PIPE_NAME = r"\\.\pipe\Flow.Launcher.Plugin.Totp"
+"""Server address on Windows
+"""
+
+IDLE_TIMEOUT = 600
+"""Seconds without requests after which the server exits
+"""
+
+LOCK_TIMEOUT = 120
+"""Seconds without requests after which decrypted keys are wiped
+"""
+
+REQUEST_TIMEOUT = 5
+"""Seconds to wait for the server response, then the request is handled locally
+"""
+
+SHUTDOWN = "shutdown"
+"""Message which stops the server
+"""
+
+PING = "ping"
+"""Message which the server sends back, to check that it's running
+"""
+
+
+def is_enabled(value) -> bool:
+    return str(value).lower() == 'true'
+
+
+def server_address():
+    """Named pipe on Windows, unix socket elsewhere
+
+    Returns:
+        Tuple[str, str]: (address, family)
+    """
+    if sys.platform == 'win32':
+        return PIPE_NAME, 'AF_PIPE'
+    import tempfile
+
+    return os.path.join(tempfile.gettempdir(), f"flow-totp-{os.getuid()}.sock"), 'AF_UNIX'
+
+
+def read_key() -> bytes:
+    with open(KEY_PATH, "rb") as f:
+        return f.read()
+
+
+def write_key(key: bytes):
+    tmp_path = f"{KEY_PATH}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(tmp_path, KEY_PATH)
+
+
+def send(message: str, timeout: float = None) -> str:
+    """Send message to the running server
+
+    Raises:
+        OSError, EOFError, AuthenticationError: If the server is not running
+
+    Returns:
+        str: Server response
+    """
+    from multiprocessing.connection import Client
+
+    address, family = server_address()
+    with Client(address, family, authkey=read_key()) as conn:
+        conn.send(message)
+        if timeout is not None and not conn.poll(timeout):
+            raise TimeoutError("Resident server does not respond")
+        return conn.recv()
+
+
+def start_server():
+    """Start the server in a detached background process
+    """
+    import subprocess
+
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    subprocess.Popen(
+        [sys.executable, main, SERVE_ARG],
+        cwd=os.getcwd(),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        **kwargs
+    )
+
+
+def forward(argv: list) -> bool:
+    """Forward JSON-RPC request to the resident server if resident mode is on.
+    If the server is not running, it is started and the request must be handled locally
+
+    Args:
+        argv (list): sys.argv, the request is argv[1]
+
+    Returns:
+        bool: True if the response was written to stdout
+    """
+    if len(argv) < 2:
+        return False
+    try:
+        request = json.loads(argv[1])
+    except ValueError:
+        return False
+    if not is_enabled((request.get('settings') or {}).get('residentMode')):
+        return False
+
+    from multiprocessing.connection import AuthenticationError
+
+    try:
+        response = send(argv[1], timeout=REQUEST_TIMEOUT)
+    except TimeoutError:
+        # the server is running, but busy
+        return False
+    except (OSError, EOFError, AuthenticationError):
+        start_server()
+        return False
+
+    sys.stdout.write(response)
+    return True
+
+
+class ResidentServer:
+    """Handles forwarded requests with the plugin loaded once
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, lock_timeout: float = LOCK_TIMEOUT):
+        """
+        Args:
+            idle_timeout (float): Seconds without requests after which the server exits
+            lock_timeout (float): Seconds without requests after which decrypted keys are wiped
+        """
+        # the whole plugin is loaded only in the server process
+        import threading
+        import plugin
+
+        self.app = plugin
+        self.app.scheduler.start()
+        self.app.watcher.start()
+        self.idle_timeout = idle_timeout
+        self.lock_timeout = lock_timeout
+        self.last_request = time.monotonic()
+        self.locked = True
+        self.running = False
+        self._lock = threading.Lock()
+
+    def handle(self, raw_request: str) -> str:
+        """Run the request the same way as main.py does in a new process
+
+        Args:
+            raw_request (str): JSON-RPC request
+
+        Returns:
+            str: JSON-RPC response written by the plugin
+        """
+        settings = json.loads(raw_request).get('settings') or {}
+        self.idle_timeout = self.setting(settings, 'residentIdleTimeout', IDLE_TIMEOUT)
+        self.lock_timeout = self.setting(settings, 'residentLockTimeout', LOCK_TIMEOUT)
+
+        import io
+        from contextlib import redirect_stdout
+
+        output = io.StringIO()
+        with self._lock:
+            self.last_request = time.monotonic()
+            self.locked = False
+            # pyflowlauncher reads the request from argv
+            sys.argv = [sys.argv[0], raw_request]
+            with redirect_stdout(output):
+                self.app.plugin.run()
+        return output.getvalue()
+
+    @staticmethod
+    def error_response(error: Exception) -> str:
+        """JSON-RPC response with the error row, so the client doesn't take the server for dead
+
+        Args:
+            error (Exception): Error of the request
+
+        Returns:
+            str: JSON-RPC response
+        """
+        from pyflowlauncher import Result, send_results
+        from plugin.lib.definitions import ERROR_ICON
+
+        return json.dumps(send_results([
+            Result(Title="Resident server error", SubTitle=str(error) or type(error).__name__, IcoPath=ERROR_ICON)
+        ]))
+
+    @staticmethod
+    def setting(settings: dict, name: str, default: float) -> float:
+        try:
+            return float(settings.get(name) or default)
+        except (TypeError, ValueError):
+            return default
+
+    def lock(self):
+        """Wipe decrypted keys, code generators and precomputed codes, the encrypted vault stays loaded
+        """
+        with self._lock:
+            self.app.scheduler.clear()
+            self.app.code_engine.clear()
+            self.app.secret_cache.clear()
+            self.locked = True
+
+    def watch(self, interval: float = 1):
+        """Lock on idle and stop the server after idle timeout
+        """
+        from multiprocessing.connection import AuthenticationError
+
+        while self.running:
+            time.sleep(interval)
+            idle = time.monotonic() - self.last_request
+            if not self.locked and idle >= self.lock_timeout:
+                self.lock()
+            if idle >= self.idle_timeout:
+                try:
+                    send(SHUTDOWN)
+                except (OSError, EOFError, AuthenticationError):
+                    pass
+                return
+
+    def serve(self, listener):
+        """Accept requests until shutdown
+
+        Args:
+            listener (multiprocessing.connection.Listener): Listening connection
+        """
+        import threading
+        from multiprocessing.connection import AuthenticationError
+
+        self.running = True
+        watchdog = threading.Thread(target=self.watch, daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except AuthenticationError:
+                    continue
+                with conn:
+                    try:
+                        message = conn.recv()
+                    except EOFError:
+                        continue
+                    if message == SHUTDOWN:
+                        return
+                    if message == PING:
+                        conn.send(PING)
+                        continue
+                    try:
+                        response = self.handle(message)
+                    except Exception as e:
+                        response = self.error_response(e)
+                    try:
+                        conn.send(response)
+                    except OSError:
+                        # the client is gone
+                        pass
+        finally:
+            self.running = False
+            self.app.scheduler.stop()
+            self.app.watcher.stop()
+            self.lock()
+
+
+def serve():
+    """Run the resident server, if it's not running yet. The server holds LOCK_PATH while it runs,
+    a server started meanwhile exits instead of removing the socket and the key of the first one
+    """
+    from multiprocessing.connection import AuthenticationError, Listener
+    from plugin.lib.locks import FileLock
+
+    lock = FileLock(path=LOCK_PATH, timeout=0)
+    try:
+        lock.acquire(exclusive=True)
+    except TimeoutError:
+        # another server is running or starting
+        return
+
+    try:
+        try:
+            if send(PING, timeout=1) == PING:
+                return
+        except (OSError, EOFError, AuthenticationError):
+            pass
+
+        address, family = server_address()
+        if family == 'AF_UNIX' and os.path.exists(address):
+            # stale socket of a killed server
+            os.remove(address)
+
+        authkey = os.urandom(32)
+        write_key(authkey)
+        server = ResidentServer()
+        with Listener(address, family, authkey=authkey) as listener:
+            server.serve(listener)
+        if os.path.exists(KEY_PATH):
+            os.remove(KEY_PATH)
+    finally:
+        lock.release()